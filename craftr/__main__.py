@@ -17,8 +17,9 @@
 from craftr import core
 from craftr.core.config import read_config_file, InvalidConfigError
 from craftr.core.logging import logger
+from craftr.core.profiler import profiler
 from craftr.core.session import session, Session, Module, MANIFEST_FILENAMES
-from craftr.utils import path, shell, tty, cson
+from craftr.utils import path, shell, tty, cson, ninjadeps, ninjalog
 from operator import attrgetter
 from nr.types.version import Version, VersionCriteria
 
@@ -26,13 +27,18 @@ import abc
 import argparse
 import atexit
 import configparser
+import craftr.core.graphdb
+import craftr.core.statcache
+import craftr.core.stats
 import craftr.defaults
 import craftr.targetbuilder
 import functools
 import json
 import os
+import sqlite3
 import sys
 import textwrap
+import time
 
 CONFIG_FILENAME = '.craftrconfig'
 INIT_DIR = path.getcwd()
@@ -53,12 +59,12 @@ def parse_cmdline_options(options):
       session.options[key] = value
 
 
-def read_cache(show_errors_and_exit=True):
+def read_cache(show_errors_and_exit=True, sections=None):
   cachefile = os.path.join(session.builddir, '.craftrcache')
   try:
-    with open(cachefile) as fp:
+    with open(cachefile, 'rb') as fp:
       try:
-        session.read_cache(fp)
+        session.read_cache(fp, sections)
       except ValueError as exc:
         logger.warn('Invalid cache: "{}"'.format(cachefile))
         logger.warn('Load error is: {}'.format(exc))
@@ -74,19 +80,23 @@ def read_cache(show_errors_and_exit=True):
 
 
 def write_cache(cachefile):
-  # Write back the cache.
+  # Write back the cache. Write to a temporary file first so that an
+  # interrupted write doesn't leave a broken cache behind. Probes that are
+  # still running in the background may write to the cache.
+  shell.wait_prefetched()
   try:
     path.makedirs(path.dirname(cachefile))
-    with open(cachefile, 'w') as fp:
+    with open(cachefile + '.tmp', 'wb') as fp:
       session.write_cache(fp)
-  except OSError as exc:
+    os.replace(cachefile + '.tmp', cachefile)
+  except (OSError, ValueError) as exc:
     logger.error('error writing cache file:', cachefile)
     logger.error(exc, indent=1)
   else:
     logger.debug('cache written:', cachefile)
 
 
-def serialise_loaded_module_info():
+def serialise_loaded_module_info(statcache):
   """
   Converts all modules that have been loaded into the active session a JSON
   serialisable object that can be saved into the Craftr cache. This cache
@@ -94,15 +104,15 @@ def serialise_loaded_module_info():
 
   This cache is loaded when the exported project is being built to register
   when files have changed in order to tell the user when a project might need
-  to be re-exported. Note that the modification time that is saved is the sum
-  of all dependent files.
+  to be re-exported. The contents of the files are hashed with the
+  :class:`~craftr.core.statcache.StatCache` *statcache*.
 
   The format is a dictionary that maps module names to the following keys:
 
   - dependent_files: A list of absolute filenames that the exported project
     depends on. This will always contain at least the manifest and the build
     script.
-  - mtime: The sum of the modification times of all files listed in
+  - digest: A hash of the names and contents of all files listed in
     *dependent_files*.
   - dependencies: A dictionary that maps the name of dependent modules to the
     version number string that was loaded when the project was exported. This
@@ -117,20 +127,21 @@ def serialise_loaded_module_info():
       module_versions[str(version)] = {
         "dependent_files": module.dependent_files,
         "dependencies": {k: str(v) for k, v in module.dependencies.items()},
-        "mtime": sum(map(path.getimtime, module.dependent_files))
+        "digest": statcache.get_digest(module.dependent_files)
       }
     if module_versions:
       modules[name] = module_versions
   return modules
 
 
-def unserialise_loaded_module_info(modules):
+def unserialise_loaded_module_info(modules, statcache=None):
   """
   This function takes the data generated with #serialise_loaded_module_info
   and converts it back to a format that is easier to use later in the build process.
   Currently, this function only converts the version-number fields to actual
-  :class:`Version` objects and adds a ``"changed"`` key to a module based on
-  the ``"mtime"`` and the current modification times of the files.
+  :class:`Version` objects and, if a *statcache* is specified, adds a
+  ``"changed"`` key to a module based on the ``"digest"`` and the current
+  contents of the files.
 
   So additionally to the fields described in #serialise_loaded_module_info(),
   the following fields are available per module description:
@@ -144,14 +155,9 @@ def unserialise_loaded_module_info(modules):
     for version, module in versions.items():
       version = Version(version)
       result[name][version] = module
-      mtime = 0
-      for fn in module['dependent_files']:
-        try:
-          mtime += path.getimtime(fn)
-        except OSError:
-          mtime = 0
-          break
-      module['changed'] = (mtime != module['mtime'])
+      if statcache is not None:
+        digest = statcache.get_digest(module['dependent_files'])
+        module['changed'] = (digest != module.get('digest'))
   return result
 
 
@@ -193,6 +199,33 @@ def get_volatile_module_version(name):
   return name, version
 
 
+def resolve_target_name(target_name, main, modules):
+  """
+  Converts a *target_name* specified on the command-line to the full name of
+  the target. Names without a module name refer to the *main* module. If the
+  version of the module is omitted, the highest version in *modules* is used,
+  which is the result of #unserialise_loaded_module_info().
+
+  :raise ValueError: If the module is not in *modules*.
+  """
+
+  if '.' not in target_name:
+    target_name = main + '.' + target_name
+  elif target_name.startswith('.'):
+    target_name = main + target_name
+
+  module_name, target_name = target_name.rpartition('.')[::2]
+  module_name, version = get_volatile_module_version(module_name)
+
+  if module_name not in modules:
+    raise ValueError('no such module: {}'.format(module_name))
+  if not version:
+    version = max(modules[module_name].keys())
+
+  return craftr.targetbuilder.get_full_name(
+      target_name, module_name=module_name, version=version)
+
+
 @functools.lru_cache()
 def get_ninja_version(ninja_bin):
   ''' Read the ninja version from the `ninja` program and return it. '''
@@ -200,6 +233,138 @@ def get_ninja_version(ninja_bin):
   return shell.pipe([ninja_bin, '--version'], shell=True).output.strip()
 
 
+def read_ninja_log(last_run=False):
+  """
+  Reads the ``.ninja_log`` from the build directory and returns a list of
+  :class:`ninjalog.LogEntry` objects. If *last_run* is True, only the
+  entries of the last Ninja invocation are returned. Returns an empty list
+  if the log does not exist or can not be read.
+  """
+
+  filename = path.join(session.builddir, '.ninja_log')
+  try:
+    entries = ninjalog.read(filename)
+  except FileNotFoundError:
+    return []
+  except (OSError, ValueError) as exc:
+    logger.warn('could not read "{}": {}'.format(filename, exc))
+    return []
+  if last_run:
+    entries = ninjalog.last_run(entries)
+  return entries
+
+
+def get_critical_path_info(dependencies, durations):
+  """
+  Computes the critical path from the *dependencies* and *durations* (see
+  :func:`core.build.get_critical_path_weights`) and returns a JSON
+  serialisable dictionary with the keys ``"duration"`` (total duration in
+  seconds) and ``"targets"`` (a list of ``[name, duration]`` pairs).
+  """
+
+  if not durations:
+    return {'duration': 0.0, 'targets': []}
+  weights = core.build.get_critical_path_weights(dependencies, durations, default=0.0)
+  targets = core.build.get_critical_path(dependencies, weights)
+  return {
+    'duration': weights[targets[0]] if targets else 0.0,
+    'targets': [[name, durations.get(name, 0.0)] for name in targets]
+  }
+
+
+def print_critical_path(title, info):
+  print()
+  print('{} ({:.2f}s)'.format(title, info['duration']))
+  print('-' * len(title))
+  if not info['targets']:
+    print('  no data available')
+  for name, duration in info['targets']:
+    print('  {:>8.2f}s  {}'.format(duration, name))
+
+
+def open_stats_database():
+  """
+  Opens the build statistics database in the build directory. Returns
+  :const:`None` if the database can not be opened.
+  """
+
+  filename = path.join(session.builddir, core.stats.FILENAME)
+  try:
+    return core.stats.StatsDatabase(filename)
+  except sqlite3.Error as exc:
+    logger.warn('could not open "{}": {}'.format(filename, exc))
+    return None
+
+
+def open_graph_database():
+  """
+  Opens the graph database in the build directory. Returns :const:`None` if
+  the database can not be opened.
+  """
+
+  filename = path.join(session.builddir, core.graphdb.FILENAME)
+  try:
+    return core.graphdb.GraphDatabase(filename)
+  except sqlite3.Error as exc:
+    logger.warn('could not open "{}": {}'.format(filename, exc))
+    return None
+
+
+def get_changed_files(spec):
+  """
+  Returns a list of the absolute filenames that changed according to
+  *spec*, which is either the name of a file that lists the changed files
+  (one per line, relative to the directory Craftr was invoked from), ``"-"``
+  to read that list from stdin or a Git revision that the working tree of
+  the project is compared with using the ``craftr.utils.git`` module.
+  """
+
+  if spec == '-' or os.path.isfile(path.norm(spec, INIT_DIR)):
+    if spec == '-':
+      lines = sys.stdin.read().split('\n')
+    else:
+      with open(path.norm(spec, INIT_DIR)) as fp:
+        lines = fp.read().split('\n')
+    return [path.norm(x.strip(), INIT_DIR) for x in lines if x.strip()]
+
+  git = session.find_module('craftr.utils.git', '*')
+  if not git.executed:
+    git.run()
+  return git.namespace.Git(session.maindir).changed_files(spec)
+
+
+def read_header_dependencies():
+  """
+  Reads the header dependencies that Ninja recorded from depfiles or MSVC's
+  ``/showIncludes`` in the build directory and returns a
+  :class:`ninjadeps.DepsLog` with absolute filenames. The log is empty if
+  nothing has been built yet.
+
+  :raise OSError: If the file can not be read.
+  :raise ValueError: If the format of the file is not supported.
+  """
+
+  filename = path.join(session.builddir, '.ninja_deps')
+  if not os.path.isfile(filename):
+    return ninjadeps.DepsLog()
+  return ninjadeps.read(filename)
+
+
+def open_stat_cache():
+  """
+  Opens the :class:`~craftr.core.statcache.StatCache` in the build directory.
+  """
+
+  return core.statcache.StatCache(path.join(session.builddir, core.statcache.FILENAME))
+
+
+def save_stat_cache(statcache):
+  try:
+    statcache.save()
+  except OSError as exc:
+    logger.warn('could not write "{}": {}'.format(statcache.filename, exc))
+
+
 def get_ninja_info():
   # Make sure the Ninja executable exists and find its version.
   ninja_bin = session.options.get('global.ninja') or \
@@ -245,7 +410,8 @@ class BuildCommand(BaseCommand):
 
   def __init__(self, mode):
     assert mode in ('clean', 'build', 'export', 'run', 'help',
-                    'dump-options', 'dump-deptree', 'lock')
+                    'dump-options', 'dump-deptree', 'lock', 'profile', 'stats',
+                    'cache', 'query', 'headers')
     self.mode = mode
 
   def build_parser(self, parser):
@@ -255,7 +421,8 @@ class BuildCommand(BaseCommand):
     # after the sub-command.
     add_arg('-v', '--verbose', action='store_true')
 
-    if self.mode not in ('dump-options', 'dump-deptree'):
+    if self.mode not in ('dump-options', 'dump-deptree', 'profile', 'stats',
+                         'cache', 'query', 'headers'):
       add_arg('-d', '--option', dest='options', action='append', default=[])
 
     if self.mode in ('export', 'run', 'help', 'dump-options', 'dump-deptree'):
@@ -264,6 +431,15 @@ class BuildCommand(BaseCommand):
     elif self.mode in ('build', 'clean'):
       add_arg('targets', metavar='TARGET', nargs='*')
 
+    if self.mode == 'build':
+      add_arg('--changed-since', metavar='REV|FILE', help='Build only the '
+        'targets that are affected by changed files, that is the targets that '
+        'read them as inputs or headers and all targets that depend on those. '
+        'Expects the name of a file that lists the changed files (one per '
+        'line, "-" to read from stdin) or a Git revision to compare the '
+        'working tree with. If TARGETs are specified, only the affected '
+        'targets among them and their dependencies are built.')
+
     if self.mode == 'run':
       add_arg('task', nargs='?')
       add_arg('task_args', nargs='*')
@@ -275,6 +451,72 @@ class BuildCommand(BaseCommand):
     if self.mode == 'clean':
       add_arg('-r', '--recursive', action='store_true')
 
+    if self.mode == 'export':
+      add_arg('--critical-path', action='store_true', help='Show the '
+        'critical path predicted at the last export and the actual critical '
+        'path of the last build.')
+      add_arg('--profile', nargs='?', const='export-profile.json',
+        metavar='FILENAME', help='Profile the export and show the time spent '
+        'per module, target generator and tool detection. The timeline is '
+        'written in the Chrome trace event format to FILENAME (relative to '
+        'the build directory, defaults to "export-profile.json").')
+      add_arg('--memprofile', action='store_true', help='Trace memory '
+        'allocations during the export and show the memory retained per '
+        'module and target generator, the top allocation sites and the peak '
+        'memory usage.')
+      add_arg('--only', metavar='TARGET', nargs='+', help='Write only the '
+        'specified targets and the targets they depend on to the manifest. '
+        'All modules are still executed. Target names without a module name '
+        'refer to the main module.')
+
+    if self.mode == 'profile':
+      add_arg('-n', '--top', type=int, default=10, help='The number of '
+        'entries to show in every section of the report.')
+      add_arg('-a', '--all', action='store_true', help='Use the most recent '
+        'entry of every output in the .ninja_log instead of only the last build.')
+      add_arg('--trace', metavar='FILENAME', help='Write the build timeline '
+        'in the Chrome trace event format to the specified file.')
+
+    if self.mode == 'stats':
+      add_arg('name', nargs='?', help='The name of a target or module to '
+        'show the duration trend for. Target names without a module are '
+        'resolved in the main module.')
+      add_arg('-r', '--regressions', action='store_true', help='Show the '
+        'targets that were slower in their last build than their baseline.')
+      add_arg('--threshold', type=float, default=1.25, help='The factor by '
+        'which a target must be slower than its baseline to be reported as '
+        'a regression. Defaults to 1.25.')
+      add_arg('--window', type=int, default=5, help='The number of previous '
+        'builds that the baseline of a target is computed from. Defaults to 5.')
+      add_arg('-n', '--limit', type=int, default=20, help='The maximum '
+        'number of runs to show.')
+
+    if self.mode == 'cache':
+      add_arg('sections', metavar='SECTION', nargs='*', help='The names of '
+        'the cache sections to show (eg. "build" or "tools"). Shows the whole '
+        'cache if omitted.')
+
+    if self.mode == 'query':
+      add_arg('query', choices=['deps', 'rdeps', 'owner', 'outputs', 'path'],
+        help='"deps" and "rdeps" show the targets that the specified targets '
+        'depend on or that depend on them (or that read the specified files), '
+        '"owner" shows the targets that produce the specified files, '
+        '"outputs" shows the output files of the specified targets and "path" '
+        'shows a chain of dependencies from the first to the second target.')
+      add_arg('names', metavar='NAME', nargs='+', help='Target names or '
+        'filenames. Target names without a module name are resolved in the '
+        'main module.')
+      add_arg('-r', '--recursive', action='store_true', help='Include '
+        'indirect dependencies or dependents.')
+
+    if self.mode == 'headers':
+      add_arg('name', nargs='?', help='A header to show the outputs that '
+        'include it, or a target or output file to show the headers that it '
+        'includes. Shows the headers that are included by the most outputs '
+        'if omitted.')
+      add_arg('-n', '--top', type=int, default=20, help='The number of '
+        'headers to show if no NAME is specified.')
+
     if self.mode == 'help':
       add_arg('name', help='The name of the symbols to show help for. Must be '
         'in the format <module>:<symbol> where <module> is the name of a '
@@ -298,6 +540,12 @@ class BuildCommand(BaseCommand):
 
   @finally_(__cleanup)
   def execute(self, parser, args):
+    if getattr(args, 'profile', None) or getattr(args, 'memprofile', False):
+      profiler.enable(memory=args.memprofile)
+
+    # Detect the Ninja version while we look for the module.
+    ninja_info = shell.prefetch(get_ninja_info)
+
     if hasattr(args, 'include_path'):
       session.path.extend(map(path.norm, args.include_path))
 
@@ -319,7 +567,7 @@ class BuildCommand(BaseCommand):
 
     module = self._find_module(parser, args)
     session.main_module = module
-    self.ninja_bin, self.ninja_version = get_ninja_info()
+    self.ninja_bin, self.ninja_version = ninja_info.result()
 
     # Create and switch to the build directory.
     session.builddir = path.abs(path.norm(args.build_dir, INIT_DIR))
@@ -338,6 +586,16 @@ class BuildCommand(BaseCommand):
       return self._build_or_clean(args)
     elif self.mode == 'lock':
       self._create_lockfile()
+    elif self.mode == 'profile':
+      return self._profile(args)
+    elif self.mode == 'stats':
+      return self._stats(args)
+    elif self.mode == 'cache':
+      return self._dump_cache(args)
+    elif self.mode == 'query':
+      return self._query(args)
+    elif self.mode == 'headers':
+      return self._headers(args)
     else:
       raise RuntimeError("mode: {}".format(self.mode))
 
@@ -382,9 +640,11 @@ class BuildCommand(BaseCommand):
     *module* and eventually export a Ninja manifest and Cache.
     """
 
+    start_time = time.time()
     read_cache(False)
 
     session.expand_relative_options()
+    previous_build = session.cache.get('build') or {}
     session.cache['build'] = {}
 
     # Load the dependency lock information if it exists.
@@ -404,6 +664,7 @@ class BuildCommand(BaseCommand):
       logger.error('error:', exc)
       return 1
     finally:
+      profiler.snapshot('run')
       if sys.exc_info() and self.mode == 'export':
         # We still want to write the cache, especially so that data already
         # loaded with loaders doesn't need to be re-loaded. They'll find out
@@ -411,8 +672,17 @@ class BuildCommand(BaseCommand):
         write_cache(self.cachefile)
 
     # Fill the cache.
+    dependencies = session.graph.get_dependency_graph()
     session.cache['build']['targets'] = list(session.graph.targets.keys())
-    session.cache['build']['modules'] = serialise_loaded_module_info()
+    session.cache['build']['graph'] = {
+      'outputs': {t.name: t.outputs for t in session.graph.targets.values()},
+      'generators': {t.name: t.generator for t in session.graph.targets.values()},
+      'explicit': [t.name for t in session.graph.targets.values() if t.explicit],
+      'dependencies': dependencies
+    }
+    statcache = open_stat_cache()
+    session.cache['build']['modules'] = serialise_loaded_module_info(statcache)
+    save_stat_cache(statcache)
     session.cache['build']['main'] = module.ident
     session.cache['build']['options'] = args.options
     session.cache['build']['dependency_lock_filename'] = deplock_fn
@@ -420,25 +690,91 @@ class BuildCommand(BaseCommand):
     if self.mode == 'export':
       # Add the Craftr_run_command variable which is necessary for tasks
       # to properly executed.
-      run_command = ['craftr', '-q', '-P', path.rel(session.maindir)]
-      if args.no_config: run_command += ['-C']
-      run_command += ['-c' + x for x in args.config]
-      run_command += ['run']
-      if args.module: run_command += ['-m', args.module]
-      run_command += ['-i' + x for x in args.include_path]
-      run_command += ['-b', path.rel(session.builddir)]
+      run_command = self._get_craftr_command(args, 'run')
       session.graph.vars['Craftr_run_command'] = shell.join(run_command)
 
+      # The command that Ninja uses to re-export the manifest when any of
+      # the files that the modules depend on changed.
+      export_command = self._get_craftr_command(args, 'export')
+      export_command += ['-d' + x for x in args.options]
+      if args.only:
+        export_command += ['--only'] + args.only
+      session.cache['build']['export_command'] = export_command
+      export_deps = [deplock_fn] if os.path.isfile(deplock_fn) else []
+      for versions in session.cache['build']['modules'].values():
+        for info in versions.values():
+          export_deps += info['dependent_files']
+
+      # Resolve the targets to export, only these can be built.
+      roots = None
+      if args.only:
+        modules = unserialise_loaded_module_info(session.cache['build']['modules'])
+        roots = []
+        for target_name in args.only:
+          try:
+            target_name = resolve_target_name(target_name, module.ident, modules)
+          except ValueError as exc:
+            logger.error(exc)
+            return 1
+          if target_name not in session.graph.targets:
+            logger.error('no such target: {}'.format(target_name))
+            return 1
+          roots.append(target_name)
+        closure = session.graph.get_closure(roots)
+        session.cache['build']['targets'] = [x for x in
+            session.cache['build']['targets'] if x in closure]
+
+      # Use the durations from the previous builds to export the targets
+      # in critical path order.
+      outputs = session.cache['build']['graph']['outputs']
+      entries = read_ninja_log()
+      durations = core.build.get_target_durations(
+          ninjalog.latest(entries).values(), outputs, session.builddir)
+      session.cache['build']['critical_path'] = get_critical_path_info(dependencies, durations)
+      if args.critical_path:
+        actual = core.build.get_target_durations(ninjalog.last_run(entries),
+            outputs, session.builddir)
+        print_critical_path('Predicted critical path (last export)',
+            previous_build.get('critical_path', {'duration': 0.0, 'targets': []}))
+        print_critical_path('Actual critical path (last build)',
+            get_critical_path_info(dependencies, actual))
+        print_critical_path('Predicted critical path (next build)',
+            session.cache['build']['critical_path'])
+        print()
+
       write_cache(self.cachefile)
 
       # Write the Ninja manifest.
       with open("build.ninja", 'w') as fp:
         platform = core.build.get_platform_helper()
-        context = core.build.ExportContext(self.ninja_version)
+        context = core.build.ExportContext(self.ninja_version, durations,
+            session.builddir, session.maindir, 'build.ninja',
+            export_command, export_deps, roots)
         writer = core.build.NinjaWriter(fp)
-        session.graph.export(writer, context, platform)
+        with profiler.section('export', 'Graph.export'):
+          session.graph.export(writer, context, platform)
+        profiler.snapshot('export')
         logger.info('exported "build.ninja"')
 
+      if args.profile or args.memprofile:
+        self._print_profile(args, module)
+
+      db = open_graph_database()
+      if db:
+        with db:
+          try:
+            db.write_graph(session.graph, module.ident, dependencies)
+          except sqlite3.Error as exc:
+            logger.warn('could not write the graph database: {}'.format(exc))
+
+      db = open_stats_database()
+      if db:
+        with db:
+          try:
+            db.add_export(time.time() - start_time, len(session.graph.targets))
+          except sqlite3.Error as exc:
+            logger.warn('could not record export statistics: {}'.format(exc))
+
       return 0
 
     elif self.mode == 'run':
@@ -460,6 +796,79 @@ class BuildCommand(BaseCommand):
 
     assert False, "unhandled mode: {}".format(self.mode)
 
+  def _get_craftr_command(self, args, mode):
+    """
+    Returns the command that invokes Craftr in the specified *mode* with the
+    project directory, configuration, main module and build directory of the
+    current invocation. Used for the commands that Ninja runs from the build
+    directory.
+    """
+
+    command = ['craftr', '-q', '-P', path.rel(session.maindir)]
+    if args.no_config: command += ['-C']
+    command += ['-c' + x for x in args.config]
+    command += [mode]
+    if args.module: command += ['-m', args.module]
+    command += ['-i' + x for x in args.include_path]
+    command += ['-b', path.rel(session.builddir)]
+    return command
+
+  def _print_profile(self, args, module):
+    """
+    Prints the sections recorded by the :data:`profiler` during the export
+    and writes the Chrome trace file.
+    """
+
+    def fmt_size(size):
+      for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+          return '{:.1f}{}'.format(size, unit)
+        size /= 1024.0
+      return '{:.1f}GB'.format(size)
+
+    if args.profile:
+      print()
+      title = '{:>10}  {:>10}  {:>6}  {:<10}  {}'.format('self', 'total', 'calls', 'category', 'name')
+      print(title)
+      print('-' * len(title))
+      for category, name, total, self_time, count, _, _ in profiler.get_totals():
+        print('{:>9.3f}s  {:>9.3f}s  {:>6}  {:<10}  {}'.format(
+          self_time, total, count, category, name))
+
+    if args.memprofile:
+      print()
+      title = '{:>10}  {:>10}  {:>6}  {:<10}  {}'.format('self', 'retained', 'calls', 'category', 'name')
+      print(title)
+      print('-' * len(title))
+      for category, name, _, _, count, mem_total, mem_self in profiler.get_totals(by_memory=True):
+        print('{:>10}  {:>10}  {:>6}  {:<10}  {}'.format(
+          fmt_size(mem_self), fmt_size(mem_total), count, category, name))
+
+      print()
+      print('Top allocation sites')
+      print('--------------------')
+      for stat in profiler.get_top_allocations(10):
+        frame = stat.traceback[0]
+        print('{:>10}  {:>8} blocks  {}:{}'.format(fmt_size(stat.size_diff),
+          stat.count_diff, frame.filename, frame.lineno))
+
+      print()
+      retained = profiler.totals.get(('module', module.ident), [0] * 5)[3]
+      num_targets = len(session.graph.targets)
+      print('Retained by modules: {} ({} per target, {} targets)'.format(
+        fmt_size(retained), fmt_size(retained / num_targets if num_targets else 0),
+        num_targets))
+      peak_rss = profiler.get_peak_rss()
+      if peak_rss is not None:
+        print('Peak RSS: {}'.format(fmt_size(peak_rss)))
+    print()
+
+    if args.profile:
+      filename = path.norm(args.profile, session.builddir)
+      with open(filename, 'w') as fp:
+        json.dump(profiler.to_chrome_trace(), fp)
+      logger.info('profile written to "{}"'.format(filename))
+
   def _dump_options(self, args, module):
     width = tty.terminal_size()[0]
 
@@ -520,25 +929,31 @@ class BuildCommand(BaseCommand):
     """
 
     # Read the cache and parse command-line options.
-    if not read_cache(True):
+    if not read_cache(True, ['build']):
       sys.exit(1)
 
     parse_cmdline_options(session.cache['build']['options'])
     main = session.cache['build']['main']
     available_targets = frozenset(session.cache['build']['targets'])
-    available_modules = unserialise_loaded_module_info(session.cache['build']['modules'])
+    statcache = open_stat_cache()
+    available_modules = unserialise_loaded_module_info(
+        session.cache['build']['modules'], statcache)
+    save_stat_cache(statcache)
 
     logger.debug('build main module:', main)
     session.expand_relative_options(get_volatile_module_version(main)[0])
 
     # Check if any of the modules changed, so we can let the user know he
-    # might have to re-export the build files.
+    # might have to re-export the build files. Manifests that contain the
+    # generator rule are re-exported by Ninja.
     changed_modules = []
     for name, versions in available_modules.items():
       for version, info in versions.items():
         if info['changed']:
           changed_modules.append('{}-{}'.format(name, version))
-    if changed_modules:
+    if changed_modules and 'export_command' in session.cache['build']:
+      logger.debug('note: modules have changed, Ninja will re-export the build files')
+    elif changed_modules:
       if len(changed_modules) == 1:
         logger.info('note: module "{}" has changed, maybe you should re-export'.format(changed_modules[0]))
       else:
@@ -549,26 +964,26 @@ class BuildCommand(BaseCommand):
     # Check the targets and if they exist.
     targets = []
     for target_name in args.targets:
-      if '.' not in target_name:
-        target_name = main + '.' + target_name
-      elif target_name.startswith('.'):
-        target_name = main + target_name
-
-      module_name, target_name = target_name.rpartition('.')[::2]
-      module_name, version = get_volatile_module_version(module_name)
-
-      if module_name not in available_modules:
-        error('no such module:', module_name)
-      if not version:
-        version = max(available_modules[module_name].keys())
-
-      target_name = craftr.targetbuilder.get_full_name(
-          target_name, module_name=module_name, version=version)
+      try:
+        target_name = resolve_target_name(target_name, main, available_modules)
+      except ValueError as exc:
+        logger.error(exc)
+        return 1
       if target_name not in available_targets:
         logger.error('no such target: {}'.format(target_name))
         return 1
       targets.append(target_name)
 
+    if self.mode == 'build' and args.changed_since:
+      targets = self._get_affected_targets(args.changed_since, targets,
+          available_targets)
+      if targets is None:
+        return 1
+      if not targets:
+        logger.info('no targets are affected by the changes')
+        return 0
+      logger.info('{} target(s) affected by the changes'.format(len(targets)))
+
     # Make sure we get all the output before running the subcommand.
     logger.flush()
 
@@ -581,10 +996,401 @@ class BuildCommand(BaseCommand):
       if not args.recursive:
         cmd += ['-r']
     cmd += targets
-    return shell.run(cmd).returncode
+
+    if self.mode == 'clean':
+      return shell.run(cmd).returncode
+
+    logfile = path.join(session.builddir, '.ninja_log')
+    try:
+      log_offset = os.path.getsize(logfile)
+    except OSError:
+      log_offset = 0
+    returncode = shell.run(cmd).returncode
+    self._record_build(logfile, log_offset, targets)
+    return returncode
+
+  def _get_affected_targets(self, changed_since, targets, available_targets):
+    """
+    Returns the names of the exported targets that are affected by the files
+    that changed according to *changed_since* (see :func:`get_changed_files`)
+    from the graph database and the header dependencies recorded by Ninja.
+    If *targets* is not empty, the result is limited to these targets and
+    their dependencies. Returns :const:`None` if an error occured.
+    """
+
+    try:
+      changed = get_changed_files(changed_since)
+    except shell.CalledProcessError as exc:
+      logger.error('could not determine the changed files: {}'.format(exc))
+      logger.error(exc.stderr.strip(), indent=1)
+      return None
+    except (OSError, Module.NotFound) as exc:
+      logger.error('could not determine the changed files: {}'.format(exc))
+      return None
+
+    if not os.path.isfile(path.join(session.builddir, core.graphdb.FILENAME)):
+      logger.error('no graph database found, please re-export')
+      return None
+    db = open_graph_database()
+    if db is None:
+      return None
+
+    # Outputs that include a changed header.
+    changed_set = set(changed)
+    try:
+      headers = read_header_dependencies()
+    except (OSError, ValueError) as exc:
+      logger.warn('could not read the header dependencies: {}'.format(exc))
+      headers = ninjadeps.DepsLog()
+    with db:
+      owners = set(db.get_owner(outfile) for outfile, deps in headers.items()
+          if changed_set.intersection(deps))
+      owners.discard(None)
+      affected = db.get_affected(changed, owners)
+
+    if targets:
+      dependencies = session.cache['build']['graph']['dependencies']
+      closure = set()
+      queue = list(targets)
+      while queue:
+        name = queue.pop()
+        if name not in closure:
+          closure.add(name)
+          queue.extend(dependencies.get(name, []))
+      affected = [x for x in affected if x in closure]
+
+    return [x for x in affected if x in available_targets]
+
+  def _record_build(self, logfile, log_offset, targets):
+    """
+    Records the targets that have been built by the last Ninja invocation
+    in the build statistics database. The entries of the invocation are the
+    ones that have been appended to the *logfile* after *log_offset*. If the
+    log is smaller than before (Ninja recompacted it), we fall back to
+    detecting the last run from the end times.
+    """
+
+    graph = session.cache['build'].get('graph')
+    if graph is None:
+      return
+    try:
+      if os.path.getsize(logfile) < log_offset:
+        entries = ninjalog.last_run(ninjalog.read(logfile))
+      else:
+        entries = ninjalog.read(logfile, log_offset)
+    except (OSError, ValueError) as exc:
+      logger.debug('could not read "{}": {}'.format(logfile, exc))
+      return
+
+    # All targets that were requested (including their dependencies) and
+    # not built by Ninja were up to date. Without targets, Ninja builds the
+    # exported targets that are not explicit.
+    if not targets:
+      explicit = set(graph.get('explicit', ()))
+      targets = [x for x in session.cache['build']['targets'] if x not in explicit]
+    requested = set()
+    stack = list(targets)
+    while stack:
+      name = stack.pop()
+      if name not in requested:
+        requested.add(name)
+        stack.extend(graph['dependencies'].get(name, ()))
+
+    durations = core.build.get_target_durations(entries, graph['outputs'], session.builddir)
+    db = open_stats_database()
+    if db:
+      with db:
+        try:
+          db.add_build(durations, len(requested - set(durations)), graph['generators'])
+        except sqlite3.Error as exc:
+          logger.warn('could not record build statistics: {}'.format(exc))
+
+  def _profile(self, args):
+    """
+    Called for the 'profile' mode. Reads the ``.ninja_log`` and maps the
+    build edges back to the targets, modules and target generators.
+    """
+
+    if not read_cache(True, ['build']):
+      sys.exit(1)
+
+    graph = session.cache['build'].get('graph')
+    if graph is None:
+      logger.error('build information is outdated, please re-export')
+      return 1
+
+    entries = read_ninja_log()
+    if args.all:
+      entries = list(ninjalog.latest(entries).values())
+    else:
+      entries = ninjalog.last_run(entries)
+    if not entries:
+      logger.error('no build information found in ".ninja_log"')
+      return 1
+
+    owners = {}
+    for name, outputs in graph['outputs'].items():
+      for filename in outputs or [path.norm(name, session.builddir)]:
+        owners[filename] = name
+
+    def get_owner(entry):
+      name = owners.get(entry.output)
+      if name is None:
+        return None, '(unknown)', '(unknown)'
+      module = name.rpartition('.')[0]
+      return name, module, graph['generators'].get(name) or '(unknown)'
+
+    def add(totals, key, duration):
+      item = totals.setdefault(key, [0.0, 0])
+      item[0] += duration
+      item[1] += 1
+
+    modules = {}
+    generators = {}
+    for entry in entries:
+      name, module, generator = get_owner(entry)
+      add(modules, module, entry.duration)
+      add(generators, generator, entry.duration)
+
+    wall = (max(e.end for e in entries) - min(e.start for e in entries)) / 1000.0
+    total = sum(e.duration for e in entries)
+
+    def print_totals(title, totals):
+      print()
+      print(title)
+      print('-' * len(title))
+      items = sorted(totals.items(), key=lambda x: x[1][0], reverse=True)
+      for key, (duration, count) in items[:args.top]:
+        print('  {:>8.2f}s  {:>5.1f}%  {:>5} edges  {}'.format(duration,
+          100.0 * duration / total if total else 0.0, count, key))
+
+    print()
+    print('{} edges, {:.2f}s wall time, {:.2f}s total, {:.2f} average parallelism'
+      .format(len(entries), wall, total, total / wall if wall else 0.0))
+    print_totals('Modules', modules)
+    print_totals('Target generators', generators)
+
+    print()
+    print('Slowest edges')
+    print('-------------')
+    for entry in sorted(entries, key=lambda x: x.duration, reverse=True)[:args.top]:
+      print('  {:>8.2f}s  {}'.format(entry.duration, path.rel(entry.output, session.builddir)))
+
+    print()
+    print('Parallelism')
+    print('-----------')
+    for start, end, value in ninjalog.get_parallelism(entries):
+      print('  {:>8.2f}s  {:>5.1f}  {}'.format(start, value, '#' * int(round(value * 2))))
+
+    durations = core.build.get_target_durations(entries, graph['outputs'], session.builddir)
+    print_critical_path('Critical path', get_critical_path_info(graph['dependencies'], durations))
+    print()
+
+    if args.trace:
+      def names(entry):
+        name, module, generator = get_owner(entry)
+        return name or path.rel(entry.output, session.builddir), module
+      with open(path.norm(args.trace, INIT_DIR), 'w') as fp:
+        json.dump(ninjalog.to_chrome_trace(entries, names), fp)
+      logger.info('trace written to "{}"'.format(args.trace))
+
+    return 0
+
+  def _stats(self, args):
+    """
+    Called for the 'stats' mode. Shows the recorded builds and exports, the
+    duration trend of a target or module or the regressions of the last
+    build compared to the previous builds.
+    """
+
+    if not read_cache(True, ['build']):
+      sys.exit(1)
+    db = open_stats_database()
+    if db is None:
+      return 1
+
+    def fmt_time(timestamp):
+      return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+    with db:
+      if args.regressions:
+        regressions = db.find_regressions(args.threshold, args.window)
+        print()
+        if not regressions:
+          print('No regressions found.')
+        for name, duration, baseline in regressions:
+          print('  {:>8.2f}s  (baseline {:.2f}s, {:+.0f}%)  {}'.format(duration,
+            baseline, 100.0 * (duration - baseline) / baseline if baseline else 0.0, name))
+        print()
+        return 0
+
+      if args.name:
+        main = session.cache['build']['main']
+        trend = None
+        for name in [args.name, main + '.' + args.name.lstrip('.')]:
+          if db.find_targets(name) == [name]:
+            trend = db.get_trend(target=name, limit=args.limit)
+            break
+        else:
+          targets = db.find_targets(args.name)
+          modules = db.find_modules(args.name)
+          if len(modules) == 1:
+            name = modules[0]
+            trend = db.get_trend(module=name, limit=args.limit)
+          elif len(targets) == 1 and not modules:
+            name = targets[0]
+            trend = db.get_trend(target=name, limit=args.limit)
+          elif targets or modules:
+            logger.error('"{}" is ambiguous:'.format(args.name))
+            for choice in sorted(targets + modules):
+              logger.error('  -', choice)
+            return 1
+          else:
+            logger.error('no statistics for "{}"'.format(args.name))
+            return 1
+
+        print()
+        print(name)
+        print('-' * len(name))
+        for run, timestamp, duration, count in trend:
+          print('  #{:<5} {}  {:>8.2f}s  {:>5} targets'.format(
+            run, fmt_time(timestamp), duration, count))
+        print()
+        return 0
+
+      print()
+      for run, kind, timestamp, duration, built, up_to_date in db.get_runs(limit=args.limit):
+        if kind == 'export':
+          info = '{} targets exported'.format(built)
+        else:
+          total = built + up_to_date
+          info = '{} built, {} up to date ({:.0f}% hit rate)'.format(built,
+            up_to_date, 100.0 * up_to_date / total if total else 0.0)
+        print('  #{:<5} {}  {:<6}  {:>8.2f}s  {}'.format(run, fmt_time(timestamp),
+          kind, duration, info))
+      print()
+    return 0
+
+  def _dump_cache(self, args):
+    """
+    Called for the 'cache' mode. Prints the Craftr cache as JSON.
+    """
+
+    if not read_cache(True, args.sections or None):
+      sys.exit(1)
+    session.dump_cache(sys.stdout)
+    print()
+    return 0
+
+  def _query(self, args):
+    """
+    Called for the 'query' mode. Answers questions about the build graph
+    from the graph database that was written by the last export.
+    """
+
+    if not os.path.isfile(path.join(session.builddir, core.graphdb.FILENAME)):
+      logger.error('no graph database found in "{}"'.format(session.builddir))
+      logger.error("Export build information using the 'craftr export' command.")
+      return 1
+    db = open_graph_database()
+    if db is None:
+      return 1
+
+    def is_filename(name):
+      return os.sep in name or '/' in name or os.path.exists(path.norm(name, INIT_DIR))
+
+    result = []
+    with db:
+      try:
+        if args.query == 'path':
+          if len(args.names) != 2:
+            logger.error('"path" expects exactly two targets')
+            return 1
+          source, dest = map(db.resolve_target, args.names)
+          result = db.get_path(source, dest)
+          if result is None:
+            logger.error('"{}" does not depend on "{}"'.format(source, dest))
+            return 1
+        for name in (args.names if args.query != 'path' else []):
+          if args.query == 'owner':
+            owner = db.get_owner(path.norm(name, INIT_DIR))
+            if owner is None:
+              logger.error('no target produces "{}"'.format(name))
+              return 1
+            names = [owner]
+          elif args.query == 'rdeps' and is_filename(name):
+            names = db.get_consumers(path.norm(name, INIT_DIR), args.recursive)
+          elif args.query == 'rdeps':
+            names = db.get_dependents(db.resolve_target(name), args.recursive)
+          elif args.query == 'deps':
+            names = db.get_dependencies(db.resolve_target(name), args.recursive)
+          else:
+            names = db.get_files(db.resolve_target(name), 'output')
+          for name in names:
+            if name not in result:
+              result.append(name)
+      except ValueError as exc:
+        logger.error(exc)
+        return 1
+
+    for name in result:
+      print(name)
+    return 0
+
+  def _headers(self, args):
+    """
+    Called for the 'headers' mode. Shows the header dependencies that Ninja
+    recorded in the ``.ninja_deps`` file.
+    """
+
+    try:
+      log = read_header_dependencies()
+    except (OSError, ValueError) as exc:
+      logger.error('could not read the header dependencies: {}'.format(exc))
+      return 1
+    if not log:
+      logger.error('no header dependencies recorded, build the project first')
+      return 1
+
+    if not args.name:
+      title = 'Headers with the highest fan-in'
+      print()
+      print(title)
+      print('-' * len(title))
+      for filename, count in log.get_fan_in(args.top):
+        print('  {:>6}  {}'.format(count, filename))
+      print()
+      return 0
+
+    # A header, an output file or a target.
+    filename = path.norm(args.name, INIT_DIR)
+    result = log.get_dependents(filename)
+    if not result:
+      result = log.get_dependencies(filename)
+    if result is None:
+      db = open_graph_database() if os.path.isfile(
+          path.join(session.builddir, core.graphdb.FILENAME)) else None
+      if db is None:
+        logger.error('"{}" is not in the header dependencies'.format(args.name))
+        return 1
+      with db:
+        try:
+          outputs = db.get_files(db.resolve_target(args.name), 'output')
+        except ValueError as exc:
+          logger.error(exc)
+          return 1
+      result = []
+      for output in outputs:
+        for header in log.get_dependencies(output) or ():
+          if header not in result:
+            result.append(header)
+
+    for filename in result:
+      print(filename)
+    return 0
 
   def _create_lockfile(self):
-    if not read_cache(True):
+    if not read_cache(True, ['build']):
       sys.exit(1)
     modules = unserialise_loaded_module_info(session.cache['build']['modules'])
     filename = session.cache['build']['dependency_lock_filename']
@@ -697,6 +1503,11 @@ def main():
     'help': BuildCommand('help'),
     'options': BuildCommand('dump-options'),
     'deptree': BuildCommand('dump-deptree'),
+    'profile': BuildCommand('profile'),
+    'stats': BuildCommand('stats'),
+    'cache': BuildCommand('cache'),
+    'query': BuildCommand('query'),
+    'headers': BuildCommand('headers'),
     'startpackage': StartpackageCommand(),
     'version': VersionCommand()
   }
@@ -30,6 +30,8 @@ from ninja_syntax import Writer as NinjaWriter
 
 import abc
 import base64
+import collections
+import itertools
 import lzma
 import ninja_syntax
 import os
@@ -154,10 +156,61 @@ class Graph(object):
     return target
 
 
+  def get_dependencies(self, target):
+    """
+    Returns a list of the names of all targets that *target* depends on,
+    that is the targets that produce any of its input files or implicit and
+    order-only dependencies.
+    """
+
+    result = []
+    for filename in itertools.chain(target.inputs, target.implicit_deps,
+        target.order_only_deps):
+      other = self.outfiles.get(filename) or self.targets.get(filename)
+      if other is not None and other is not target:
+        pyutils.unique_append(result, other.name)
+    return result
+
+  def get_closure(self, roots):
+    """
+    Returns a set of the names of the targets in *roots* and of all targets
+    that they depend on, directly or indirectly.
+
+    :param roots: A list of target names.
+    :raise KeyError: If a name in *roots* is not a target in the graph.
+    """
+
+    result = set()
+    stack = list(roots)
+    while stack:
+      name = stack.pop()
+      if name not in result:
+        stack.extend(self.get_dependencies(self.targets[name]))
+        result.add(name)
+    return result
+
+  def get_dependency_graph(self):
+    """
+    Returns a dictionary that maps the name of every target in the graph to
+    the list of target names returned by :meth:`get_dependencies`.
+    """
+
+    return {t.name: self.get_dependencies(t) for t in self.targets.values()}
+
   def export(self, writer, context, platform):
     """
     Export the build graph to a Ninja manifest.
 
+    If :attr:`ExportContext.durations` is set, the targets are exported
+    ordered by their critical path weight (see
+    :func:`get_critical_path_weights`) so that Ninja starts the targets on
+    the longest path through the build first.
+
+    If :attr:`ExportContext.roots` is set, only these targets and the
+    targets they depend on are exported (see :meth:`get_closure`). The
+    other targets must still be in the graph, as it is only known which
+    targets are needed once all targets have been created.
+
     :param writer: A :class:`ninja_syntax.Writer` object.
     :param context: A :class:`ExportContext` object.
     :param platform: A :class:`PlatformHelper` instance.
@@ -180,8 +233,61 @@ class Graph(object):
         tool.export(writer, context, platform)
       writer.newline()
 
+    if context.roots is None:
+      targets = list(self.targets.values())
+    else:
+      closure = self.get_closure(context.roots)
+      targets = [t for t in self.targets.values() if t.name in closure]
+
+    if context.regenerate_command:
+      # Let Ninja re-export the manifest when a file that any module depends
+      # on changed. Every dependency also gets a phony build statement so
+      # that removing it triggers the export instead of a Ninja error. Files
+      # in the build directory are written by Craftr or Ninja themselves.
+      outputs = set(context.relpath(x) for t in targets for x in t.outputs)
+      deps = set()
+      for dep in context.regenerate_deps:
+        if context.builddir and path.isabs(dep):
+          norm = path.norm(dep)
+          if norm == context.builddir or norm.startswith(context.builddir + os.sep):
+            continue
+        deps.add(context.relpath(dep))
+      deps = sorted(deps - outputs)
+      title = 'Regenerate ' + context.manifest
+      writer.comment(title)
+      writer.comment('-' * len(title))
+      command = ninja_syntax.escape(shell.join(context.regenerate_command))
+      writer.rule('Craftr_regenerate', command,
+        description='Regenerating ' + context.manifest, generator=True)
+      writer.build(context.manifest, 'Craftr_regenerate', implicit=deps)
+      for dep in deps:
+        if dep != context.manifest:
+          writer.build(dep, 'phony')
+      writer.newline()
+
+    if context.durations:
+      weights = get_critical_path_weights(self.get_dependency_graph(),
+          context.durations)
+      targets.sort(key=lambda t: weights[t.name], reverse=True)
+
+    # Hoist flag lists that are shared by multiple commands into variables.
+    frameworks = []
+    for target in targets:
+      command = target.get_single_command(context, platform)
+      if command is not None:
+        context.commands[target.name] = command
+        frameworks.append(target.frameworks)
+    context.flag_vars = get_flag_variables(context.commands.values(),
+      frameworks=frameworks, relpath=context.relpath)
+    if context.flag_vars:
+      writer.comment('Shared flags')
+      writer.comment('------------')
+      for run, name in context.flag_vars.items():
+        writer.variable(name, shell.join(run, for_ninja=True))
+      writer.newline()
+
     defaults = []
-    for target in self.targets.values():
+    for target in targets:
       if not target.explicit and target.generates_build_instruction:
         defaults.append(target.name)
       target.export(writer, context, platform)
@@ -194,13 +300,24 @@ class Target(object):
   A higher level abstraction of a Target that can be added to a :class:`Graph`
   and then exported into a Ninja build manifest. A target should be treated
   as read-only always.
+
+  The *generator* is the name of the target generator function that created
+  the target (eg. ``"CompilerLinker.compile"``). It is used for reporting
+  purposes only.
+
+  If *restat* is True, Ninja re-checks the modification times of the outputs
+  after the target was built and skips targets that depend on outputs that
+  did not change. Use it for code generators that leave their output files
+  untouched when the content would not change (see
+  :func:`craftr.utils.path.write_if_changed`).
   """
 
   def __init__(self, name, commands, inputs, outputs, implicit_deps=(),
                order_only_deps=(), pool=None, deps=None, depfile=None,
                msvc_deps_prefix=None, explicit=False, foreach=False,
                description=None, metadata=None, cwd=None, environ=None,
-               frameworks=(), task=None, runprefix=None):
+               frameworks=(), task=None, runprefix=None, generator=None,
+               restat=False):
     argspec.validate('name', name, {'type': str})
     argspec.validate('commands', commands,
       {'type': list, 'allowEmpty': False, 'items':
@@ -222,6 +339,8 @@ class Target(object):
     argspec.validate('frameworks', frameworks, {'type': [list, tuple], 'items': {'type': dict}})
     argspec.validate('task', task, {'type': [None, Task]})
     argspec.validate('runprefix', runprefix, {'type': [None, list, str], 'items': {'type': str}})
+    argspec.validate('generator', generator, {'type': [None, str]})
+    argspec.validate('restat', restat, {'type': bool})
 
     if isinstance(runprefix, str):
       runprefix = shell.split(runprefix)
@@ -279,6 +398,8 @@ class Target(object):
     self.frameworks = frameworks
     self.task = task
     self.runprefix = runprefix
+    self.generator = generator
+    self.restat = restat
 
     if self.foreach and len(self.inputs) != len(self.outputs):
       raise ValueError('foreach target must have the same number of output '
@@ -314,24 +435,30 @@ class Target(object):
 
     writer.comment("target: {}".format(self.name))
     writer.comment("--------" + "-" * len(self.name))
-    commands = platform.prepare_commands([list(map(str, c)) for c in self.commands])
+
+    relpath = context.relpath if self.cwd is None else (lambda x: x)
+    inputs = [relpath(x) for x in self.inputs]
+    outputs = [relpath(x) for x in self.outputs]
+    implicit_deps = [relpath(x) for x in self.implicit_deps]
+    order_only_deps = [relpath(x) for x in self.order_only_deps]
 
     # Check if we need to export a command file or can export the command
     # directly.
-    if not self.environ and len(commands) == 1:
-      commands = [platform.prepare_single_command(commands[0], self.cwd)]
+    command = context.commands.pop(self.name, None)
+    if command is None:
+      command = self.get_single_command(context, platform)
+    if command is not None:
+      command = replace_flag_variables(command, context.flag_vars)
     else:
       filename = path.join('.commands', self.name)
-      command, __ = platform.write_command_file(filename, commands,
-        self.inputs, self.outputs, cwd=self.cwd, environ=self.environ,
-        foreach=self.foreach)
-      commands = [command]
-
-    assert len(commands) == 1
-    command = shell.join(commands[0], for_ninja=True)
+      command, __ = platform.write_command_file(filename,
+        self.get_commands(context, platform), inputs, outputs, cwd=self.cwd,
+        environ=self.environ, foreach=self.foreach)
+    command = shell.join(command, for_ninja=True)
 
     writer.rule(self.name, command, pool=self.pool, deps=self.deps,
-      depfile=self.depfile, description=self.description)
+      depfile=self.depfile, description=self.description,
+      restat=self.restat)
 
     if self.msvc_deps_prefix:
       # We can not write msvc_deps_prefix on the rule level with Ninja
@@ -342,24 +469,52 @@ class Target(object):
 
     writer.newline()
     if self.foreach:
-      assert len(self.inputs) == len(self.outputs)
-      for infile, outfile in zip(self.inputs, self.outputs):
+      assert len(inputs) == len(outputs)
+      for infile, outfile in zip(inputs, outputs):
         writer.build(
           [outfile],
           self.name,
           [infile],
-          implicit=self.implicit_deps,
-          order_only=self.order_only_deps)
+          implicit=implicit_deps,
+          order_only=order_only_deps)
     else:
       writer.build(
-        self.outputs or [self.name],
+        outputs or [self.name],
         self.name,
-        self.inputs,
-        implicit=self.implicit_deps,
-        order_only=self.order_only_deps)
+        inputs,
+        implicit=implicit_deps,
+        order_only=order_only_deps)
 
-    if self.outputs and self.name not in self.outputs and not self.explicit:
-      writer.build(self.name, 'phony', self.outputs)
+    if outputs and self.name not in outputs and not self.explicit:
+      writer.build(self.name, 'phony', outputs)
+
+  def get_commands(self, context, platform):
+    """
+    Returns the commands of the target as lists of strings as they are
+    exported. Filenames are made relative to the build directory (see
+    :meth:`ExportContext.relarg`), unless the target has a custom working
+    directory.
+    """
+
+    if self.cwd is not None:
+      commands = [[str(x) for x in c] for c in self.commands]
+    else:
+      commands = [[context.relarg(str(x), program=(i == 0)) for i, x in enumerate(c)]
+          for c in self.commands]
+    return platform.prepare_commands(commands)
+
+  def get_single_command(self, context, platform):
+    """
+    Returns the command that is exported into the Ninja manifest for the
+    target as a list of strings, or :const:`None` if the target requires a
+    command file because it has multiple commands or environment variables
+    that can not be inlined (see :meth:`PlatformHelper.prepare_inline_commands`).
+    """
+
+    commands = self.get_commands(context, platform)
+    if not self.environ and len(commands) == 1:
+      return platform.prepare_single_command(commands[0], self.cwd)
+    return platform.prepare_inline_commands(commands, self.cwd, self.environ)
 
   @property
   def generates_build_instruction(self):
@@ -506,10 +661,118 @@ class ExportContext(object):
   the exported manifest.
 
   .. attribute:: ninja_version
+
+  .. attribute:: durations
+
+    A dictionary that maps target names to their expected build duration
+    in seconds, usually read from a previous ``.ninja_log``. If specified,
+    the targets are exported in critical path order. Can be :const:`None`.
+
+  .. attribute:: builddir
+
+    The build directory in which Ninja is run. If specified, filenames inside
+    the build directory or the :attr:`rootdir` are exported relative to it.
+    Can be :const:`None`.
+
+  .. attribute:: rootdir
+
+    The root directory of the project. Can be :const:`None`.
+
+  .. attribute:: manifest
+
+    The filename of the Ninja manifest, relative to the :attr:`builddir`.
+
+  .. attribute:: regenerate_command
+
+    The command that exports the manifest again. If specified,
+    :meth:`Graph.export` writes a generator rule with this command so that
+    Ninja regenerates the manifest when one of the
+    :attr:`regenerate_deps` changed. Can be :const:`None`.
+
+  .. attribute:: regenerate_deps
+
+    A list of the files that the manifest depends on.
+
+  .. attribute:: roots
+
+    A list of the names of the targets that are exported together with
+    their dependencies. If :const:`None`, all targets are exported.
+
+  .. attribute:: commands
+
+    A dictionary that maps target names to their single command, filled by
+    :meth:`Graph.export` before the targets are exported.
+
+  .. attribute:: flag_vars
+
+    A dictionary that maps tuples of flags to the name of the Ninja variable
+    that they have been exported to (see :func:`get_flag_variables`).
   """
 
-  def __init__(self, ninja_version):
+  #: Prefixes of command-line arguments that are followed by a filename.
+  PATH_FLAGS = ('-I', '-L', '-o', '-MF', '-MT', '-MQ', '/Fo', '/Fe', '/Fd',
+      '/Fp', '/I', '/OUT:', '/IMPLIB:', '/PDB:', '/LIBPATH:')
+
+  def __init__(self, ninja_version, durations=None, builddir=None, rootdir=None,
+               manifest='build.ninja', regenerate_command=None, regenerate_deps=(),
+               roots=None):
     self.ninja_version = ninja_version
+    self.durations = durations
+    self.builddir = path.norm(builddir) if builddir else None
+    self.rootdir = path.norm(rootdir) if rootdir else None
+    self.manifest = manifest
+    self.regenerate_command = regenerate_command
+    self.regenerate_deps = regenerate_deps
+    self.roots = roots
+    self.commands = {}
+    self.flag_vars = {}
+
+  def relpath(self, filename):
+    """
+    Returns *filename* relative to the :attr:`builddir` if it is inside the
+    :attr:`builddir` or the :attr:`rootdir`, otherwise *filename* is
+    returned unchanged. Ninja runs the commands in the build directory, thus
+    the exported manifest does not depend on the location of the project.
+    """
+
+    if not self.builddir or not path.isabs(filename):
+      return filename
+    norm = path.norm(filename)
+    for parent in (self.builddir, self.rootdir):
+      if parent and (norm == parent or norm.startswith(parent + os.sep)):
+        try:
+          return os.path.relpath(norm, self.builddir)
+        except ValueError:
+          break  # different drives on Windows
+    return filename
+
+  def relarg(self, arg, program=False):
+    """
+    Like :meth:`relpath`, but also handles command-line arguments that are
+    a filename prefixed with one of the :attr:`PATH_FLAGS` (eg.
+    ``-I/project/include``). Other arguments, for example defines or linker
+    options that contain a filename, are returned unchanged as the filename
+    could be used at runtime.
+
+    If *program* is True, *arg* is the program of a command. A program in
+    the build directory is then prefixed with ``./``, otherwise the shell
+    would search it in the ``PATH``.
+    """
+
+    if isinstance(arg, shell.safe):
+      return arg
+    result = self.relpath(arg)
+    if result is not arg:
+      if program and os.sep not in result and (not os.altsep or os.altsep not in result):
+        result = path.curdir_sep + result
+      return result
+    for flag in self.PATH_FLAGS:
+      if arg.startswith(flag) and len(arg) > len(flag):
+        rest = arg[len(flag):]
+        result = self.relpath(rest)
+        if result is not rest:
+          return flag + result
+    return arg
 
 
 class PlatformHelper(object, metaclass=abc.ABCMeta):
@@ -533,6 +796,20 @@ class PlatformHelper(object, metaclass=abc.ABCMeta):
     new command including the current working directory switch.
     """
 
+  def prepare_inline_commands(self, commands, cwd, environ):
+    """
+    Given multiple commands as lists of strings, an optional working
+    directory and a dictionary of environment variables, return a single
+    command as a list of strings that executes all commands in the Ninja
+    rule itself, or :const:`None` if the commands must be written to a
+    command file with :meth:`write_command_file` instead.
+
+    References to ``$in`` and ``$out`` are left for Ninja to expand. The
+    default implementation returns :const:`None`.
+    """
+
+    return None
+
   @abc.abstractmethod
   def write_command_file(self, filename, commands, inputs=None, outputs=None,
       cwd=None, environ=None, foreach=False, suffix=Default, dry=False,
@@ -606,13 +883,10 @@ class WindowsPlatformHelper(PlatformHelper):
   def prepare_commands(self, commands):
     # ISSUE craftr-build/craftr#67
     # On Windows, commands that are not executables need to be invoked via CMD.
+    programs = shell.find_programs(args[0] for args in commands)
     new_commands = []
     for args in commands:
-      try:
-        prog = shell.find_program(args[0])
-        is_executable = prog.endswith('.exe')
-      except FileNotFoundError:
-        is_executable = args[0].endswith('.exe')
+      is_executable = programs.get(args[0], args[0]).endswith('.exe')
       if not is_executable:
         args = ['cmd', '/c'] + args
       new_commands.append(args)
@@ -658,6 +932,10 @@ class WindowsPlatformHelper(PlatformHelper):
 
 class UnixPlatformHelper(PlatformHelper):
 
+  #: The maximum length of the commands that are inlined by
+  #: :meth:`prepare_inline_commands`.
+  MAX_INLINE_LENGTH = 8192
+
   def prepare_commands(self, commands):
     return commands
 
@@ -666,6 +944,24 @@ class UnixPlatformHelper(PlatformHelper):
       command = [shell.safe('('), 'cd', cwd, shell.safe('&&')] + command + [shell.safe(')')]
     return command
 
+  def prepare_inline_commands(self, commands, cwd, environ):
+    # Ninja would expand references to any other variable than $in and
+    # $out, the command file keeps them literal.
+    strings = itertools.chain(environ.values(), *commands)
+    if any('$' in re.sub(r'\$(in|out)\b', '', x) for x in strings
+        if not isinstance(x, shell.safe)):
+      return None
+
+    result = []
+    for key, value in environ.items():
+      result += ['export', shell.safe('{}={}'.format(key, shell.quote(value))), shell.safe('&&')]
+    for command in commands:
+      result += command + [shell.safe('&&')]
+    result = self.prepare_single_command(result[:-1], cwd)
+    if len(shell.join(result)) > self.MAX_INLINE_LENGTH:
+      return None
+    return result
+
   def write_command_file(self, filename, commands, inputs=None, outputs=None,
       cwd=None, environ=None, foreach=False, suffix='.sh', dry=False,
       accept_additional_args=False):
@@ -704,6 +1000,262 @@ class UnixPlatformHelper(PlatformHelper):
     return result, filename
 
 
+def _get_flag_runs(command, min_length):
+  """
+  Yields ``(start, end)`` tuples for the maximal runs of consecutive flags
+  in *command* that have at least *min_length* elements. A flag is an
+  argument that starts with a dash (or a slash on Windows) and does not
+  reference a Ninja variable.
+  """
+
+  prefixes = ('-', '/') if os.name == 'nt' else ('-',)
+  start = None
+  for index, arg in enumerate(itertools.chain(command, [None])):
+    is_flag = (arg is not None and not isinstance(arg, shell.safe) and
+        arg.startswith(prefixes) and '$' not in arg)
+    if is_flag and start is None:
+      start = index
+    elif not is_flag and start is not None:
+      if index - start >= min_length:
+        yield start, index
+      start = None
+
+
+def _iter_frameworks(frameworks):
+  """
+  Yields the *frameworks* and the frameworks listed in their
+  ``'frameworks'`` key, recursively, each only once.
+  """
+
+  seen = set()
+  stack = list(reversed(frameworks))
+  while stack:
+    fw = stack.pop()
+    if id(fw) in seen or not isinstance(fw, dict):
+      continue
+    seen.add(id(fw))
+    yield fw
+    stack.extend(reversed(fw.get('frameworks') or ()))
+
+
+def _find_framework_flags(command, frameworks, relpath=None):
+  """
+  Yields ``(start, end, name)`` tuples for the runs of flags in *command*
+  that have been generated from a list option of one of the *frameworks*,
+  for example ``-I`` flags from the ``'include'`` option. A run matches
+  if every value of the option appears in the same order, each with the
+  same prefix (eg. ``-I``, ``/I`` or none). *relpath* is applied to the
+  values to match filenames that have been made relative in *command*.
+  *name* is the name of the framework and the option.
+  """
+
+  prefixes = ('-', '/') if os.name == 'nt' else ('-',)
+  for fw in _iter_frameworks(frameworks):
+    fw_name = getattr(fw, 'name', None)
+    if not fw_name:
+      continue
+    for key, value in sorted(fw.items()):
+      if key == 'frameworks' or not isinstance(value, (list, tuple)) or not value:
+        continue
+      if not all(isinstance(x, str) and x for x in value):
+        continue
+      values = [relpath(x) if relpath else x for x in value]
+      first = values[0]
+      for index, arg in enumerate(command):
+        if isinstance(arg, shell.safe) or '$' in arg or not arg.startswith(prefixes):
+          continue
+        if not arg.endswith(first):
+          continue
+        prefix = arg[:len(arg) - len(first)]
+        end = index + len(values)
+        if tuple(command[index:end]) == tuple(prefix + x for x in values):
+          yield index, end, re.sub(r'\W', '_', '{}_{}'.format(fw_name, key))
+          break
+
+
+def get_flag_variables(commands, min_length=2, min_count=2, min_size=40,
+    frameworks=None, relpath=None):
+  """
+  Finds the runs of flags that occur in at least *min_count* of the
+  *commands* and returns a dictionary that maps each run as a tuple to the
+  name of a Ninja variable. Runs shorter than *min_size* characters are not
+  worth a variable.
+
+  If *frameworks* is specified, it must be a list with the frameworks of
+  the target of every command. The flags that a framework option
+  contributes to the commands (see :func:`_find_framework_flags`) are
+  exported to a variable named after the framework and option, for example
+  ``fw_qt5_include``, even if other flags of the target surround them.
+  Of the remaining flags, runs of at least *min_length* consecutive flags
+  that are exactly the same in multiple commands are exported to variables
+  ``flags_0``, ``flags_1``, etc.
+  """
+
+  commands = list(commands)
+  result = collections.OrderedDict()
+  used_names = set()
+
+  def add(run, name):
+    index = 0
+    unique = name
+    while unique in used_names:
+      index += 1
+      unique = '{}_{}'.format(name, index)
+    used_names.add(unique)
+    result[run] = unique
+
+  def worth(run, count):
+    return count >= min_count and sum(map(len, run)) + len(run) >= min_size
+
+  if frameworks is not None:
+    counts = collections.Counter()
+    names = {}
+    for command, fws in zip(commands, frameworks):
+      for start, end, name in _find_framework_flags(command, fws, relpath):
+        run = tuple(command[start:end])
+        counts[run] += 1
+        names.setdefault(run, name)
+    for run, count in counts.items():
+      if worth(run, count):
+        add(run, 'fw_' + names[run])
+    commands = [replace_flag_variables(x, result) for x in commands]
+
+  counts = collections.Counter()
+  for command in commands:
+    for start, end in _get_flag_runs(command, min_length):
+      counts[tuple(command[start:end])] += 1
+  index = 0
+  for run, count in counts.items():
+    if worth(run, count):
+      add(run, 'flags_{}'.format(index))
+      index += 1
+  return result
+
+
+def replace_flag_variables(command, flag_vars):
+  """
+  Replaces the runs of flags in *command* that are listed in *flag_vars*
+  (see :func:`get_flag_variables`) with a reference to their variable.
+  Longer runs are replaced first.
+  """
+
+  if not flag_vars:
+    return command
+  candidates = collections.defaultdict(list)
+  for run in sorted(flag_vars, key=len, reverse=True):
+    candidates[run[0]].append(run)
+  result = []
+  index = 0
+  while index < len(command):
+    arg = command[index]
+    runs = () if isinstance(arg, shell.safe) else candidates.get(arg, ())
+    for run in runs:
+      if tuple(command[index:index + len(run)]) == run:
+        result.append(shell.safe('$' + flag_vars[run]))
+        index += len(run)
+        break
+    else:
+      result.append(arg)
+      index += 1
+  return result
+
+
+def get_target_durations(entries, outputs, builddir):
+  """
+  Maps the :class:`~craftr.utils.ninjalog.LogEntry` objects in *entries* to
+  the targets that produce them. Returns a dictionary that maps target names
+  to durations in seconds. If a target produces multiple build edges (eg. a
+  *foreach* target), the duration of the longest edge is used as these edges
+  can run in parallel.
+
+  :param entries: A list of :class:`~craftr.utils.ninjalog.LogEntry` objects.
+  :param outputs: A dictionary that maps target names to the list of their
+    absolute output filenames.
+  :param builddir: The build directory. Targets without output files are
+    logged by Ninja under their name relative to this directory.
+  """
+
+  owners = {}
+  for name, files in outputs.items():
+    for filename in files or [path.norm(name, builddir)]:
+      owners[filename] = name
+
+  result = {}
+  for entry in entries:
+    name = owners.get(entry.output)
+    if name is not None:
+      result[name] = max(result.get(name, 0.0), entry.duration)
+  return result
+
+
+def _get_consumers(dependencies):
+  consumers = {name: [] for name in dependencies}
+  for name, deps in dependencies.items():
+    for dep in deps:
+      consumers.setdefault(dep, []).append(name)
+  return consumers
+
+
+def get_critical_path_weights(dependencies, durations, default=None):
+  """
+  Computes the critical path weight of every target, which is the duration
+  of the target itself plus the largest weight of all targets that depend on
+  it. In other words, the weight is the minimum time it takes to finish the
+  build once the target has been started.
+
+  :param dependencies: A dictionary that maps target names to a list of names
+    of the targets they depend on (see :meth:`Graph.get_dependency_graph`).
+  :param durations: A dictionary that maps target names to their duration
+    in seconds.
+  :param default: The duration assumed for targets that are not listed in
+    *durations*. Defaults to the mean of all known durations.
+  :return: A dictionary that maps target names to their weight.
+  """
+
+  if default is None:
+    default = sum(durations.values()) / len(durations) if durations else 0.0
+  consumers = _get_consumers(dependencies)
+
+  weights = {}
+  visiting = set()
+  for root in consumers:
+    stack = [(root, False)]
+    while stack:
+      name, expanded = stack.pop()
+      if name in weights or (not expanded and name in visiting):
+        continue
+      if expanded:
+        weight = max((weights.get(x, 0.0) for x in consumers[name]), default=0.0)
+        weights[name] = durations.get(name, default) + weight
+        visiting.discard(name)
+      else:
+        visiting.add(name)
+        stack.append((name, True))
+        stack.extend((x, False) for x in consumers[name] if x not in weights)
+
+  return weights
+
+
+def get_critical_path(dependencies, weights):
+  """
+  Returns the list of target names on the critical path, starting with the
+  target that has to be built first. *weights* must be the result of
+  :func:`get_critical_path_weights`.
+  """
+
+  if not weights:
+    return []
+
+  consumers = _get_consumers(dependencies)
+  key = lambda x: (weights.get(x, 0.0), x)
+  name = max(weights, key=key)
+  result = [name]
+  while consumers.get(name):
+    name = max(consumers[name], key=key)
+    result.append(name)
+  return result
+
+
 def get_platform_helper():
   if platform.name == 'win':
     return WindowsPlatformHelper()
@@ -0,0 +1,300 @@
+# The Craftr build system
+# Copyright (C) 2016  Niklas Rosenstein
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+:mod:`craftr.core.graphdb`
+==========================
+
+This module implements the graph database that Craftr writes to the build
+directory on every export. It contains the targets of the build graph with
+their module, target generator and metadata, the files they read and
+produce and the dependencies between the targets. The ``craftr query``
+command answers questions about the build graph from this database without
+executing any module.
+"""
+
+import collections
+import json
+import re
+import sqlite3
+
+#: The name of the graph database file in the build directory.
+FILENAME = '.craftrgraph'
+
+#: The kinds of files that are associated with a target in the database.
+FILE_KINDS = ('input', 'output', 'implicit', 'order_only')
+
+
+class GraphDatabase(object):
+  """
+  Wrapper for the SQLite graph database.
+
+  :param filename: The filename of the database. Will be created if it
+    does not exist.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.conn = sqlite3.connect(filename)
+    self.conn.executescript('''
+      CREATE TABLE IF NOT EXISTS info (
+        key TEXT PRIMARY KEY,
+        value TEXT
+      );
+      CREATE TABLE IF NOT EXISTS targets (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        module TEXT NOT NULL,
+        generator TEXT,
+        explicit INTEGER NOT NULL DEFAULT 0,
+        metadata TEXT
+      );
+      CREATE TABLE IF NOT EXISTS files (
+        target INTEGER NOT NULL REFERENCES targets(id),
+        kind TEXT NOT NULL,
+        filename TEXT NOT NULL
+      );
+      CREATE TABLE IF NOT EXISTS edges (
+        target INTEGER NOT NULL REFERENCES targets(id),
+        dependency INTEGER NOT NULL REFERENCES targets(id)
+      );
+      CREATE INDEX IF NOT EXISTS targets_module ON targets (module);
+      CREATE INDEX IF NOT EXISTS files_filename ON files (filename, kind);
+      CREATE INDEX IF NOT EXISTS files_target ON files (target, kind);
+      CREATE INDEX IF NOT EXISTS edges_target ON edges (target);
+      CREATE INDEX IF NOT EXISTS edges_dependency ON edges (dependency);
+    ''')
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.conn.close()
+
+  def write_graph(self, graph, main=None, dependencies=None):
+    """
+    Replaces the contents of the database with the targets of the
+    :class:`~craftr.core.build.Graph` *graph*.
+
+    :param main: The identifier of the main module. Target names that are
+      passed to the query methods are resolved in this module.
+    :param dependencies: The result of
+      :meth:`~craftr.core.build.Graph.get_dependency_graph`. Will be computed
+      if omitted.
+    """
+
+    if dependencies is None:
+      dependencies = graph.get_dependency_graph()
+    ids = {name: index for index, name in enumerate(graph.targets, 1)}
+
+    def files(target):
+      for kind, filenames in zip(FILE_KINDS, (target.inputs, target.outputs,
+          target.implicit_deps, target.order_only_deps)):
+        for filename in filenames:
+          # Implicit dependencies can be target names as well.
+          if filename not in graph.targets:
+            yield (ids[target.name], kind, filename)
+
+    with self.conn:
+      for table in ('info', 'edges', 'files', 'targets'):
+        self.conn.execute('DELETE FROM ' + table)
+      self.conn.execute('INSERT INTO info (key, value) VALUES (?, ?)', ('main', main))
+      self.conn.executemany(
+        'INSERT INTO targets (id, name, module, generator, explicit, metadata) VALUES (?, ?, ?, ?, ?, ?)',
+        [(ids[t.name], t.name, t.name.rpartition('.')[0], t.generator,
+          int(t.explicit), json.dumps(t.metadata, default=repr, sort_keys=True))
+          for t in graph.targets.values()])
+      self.conn.executemany(
+        'INSERT INTO files (target, kind, filename) VALUES (?, ?, ?)',
+        (row for t in graph.targets.values() for row in files(t)))
+      self.conn.executemany(
+        'INSERT INTO edges (target, dependency) VALUES (?, ?)',
+        [(ids[name], ids[dep]) for name, deps in dependencies.items() for dep in deps])
+
+  def get_main(self):
+    """
+    Returns the identifier of the main module or :const:`None`.
+    """
+
+    row = self.conn.execute('SELECT value FROM info WHERE key = ?', ('main',)).fetchone()
+    return row[0] if row else None
+
+  def find_targets(self, name):
+    """
+    Returns a list of all target names in the database that are equal to
+    *name* or end with ``"." + name``.
+    """
+
+    pattern = '%.' + re.sub(r'([\\%_])', r'\\\1', name)
+    rows = self.conn.execute(
+      "SELECT name FROM targets WHERE name = ? OR name LIKE ? ESCAPE '\\' ORDER BY name",
+      (name, pattern))
+    return [row[0] for row in rows]
+
+  def resolve_target(self, name):
+    """
+    Returns the full name of the target *name*. The name may omit the module,
+    in which case the target is looked up in the main module first and then
+    in all other modules.
+
+    :raise ValueError: If there is no such target or *name* is ambiguous.
+    """
+
+    main = self.get_main()
+    candidates = [name]
+    if main:
+      candidates.append(main + '.' + name.lstrip('.'))
+    for candidate in candidates:
+      if self.find_targets(candidate)[:1] == [candidate]:
+        return candidate
+    targets = self.find_targets(name.lstrip('.'))
+    if len(targets) == 1:
+      return targets[0]
+    elif targets:
+      raise ValueError('"{}" is ambiguous: {}'.format(name, ', '.join(targets)))
+    raise ValueError('no such target: "{}"'.format(name))
+
+  def get_dependencies(self, target, recursive=False):
+    """
+    Returns a sorted list of the names of the targets that *target* depends
+    on. If *recursive* is True, indirect dependencies are included.
+    """
+
+    return self._walk(target, 'target', 'dependency', recursive)
+
+  def get_dependents(self, target, recursive=False):
+    """
+    Returns a sorted list of the names of the targets that depend on
+    *target*. If *recursive* is True, indirect dependents are included.
+    """
+
+    return self._walk(target, 'dependency', 'target', recursive)
+
+  def _walk(self, target, source, dest, recursive):
+    if recursive:
+      query = '''
+        WITH RECURSIVE walk(id) AS (
+          SELECT id FROM targets WHERE name = ?
+          UNION
+          SELECT edges.{dest} FROM edges JOIN walk ON edges.{source} = walk.id
+        )
+        SELECT name FROM targets JOIN walk ON targets.id = walk.id
+        WHERE name != ? ORDER BY name
+      '''
+    else:
+      query = '''
+        SELECT dst.name FROM edges
+        JOIN targets AS src ON edges.{source} = src.id
+        JOIN targets AS dst ON edges.{dest} = dst.id
+        WHERE src.name = ? AND dst.name != ? ORDER BY dst.name
+      '''
+    rows = self.conn.execute(query.format(source=source, dest=dest), (target, target))
+    return [row[0] for row in rows]
+
+  def get_consumers(self, filename, recursive=False):
+    """
+    Returns a sorted list of the names of the targets that read *filename*
+    as an input or implicit dependency. If *recursive* is True, the targets
+    that depend on these targets are included.
+    """
+
+    rows = self.conn.execute('''
+      SELECT DISTINCT targets.name FROM files JOIN targets ON files.target = targets.id
+      WHERE files.filename = ? AND files.kind IN ('input', 'implicit', 'order_only')
+    ''', (filename,))
+    result = set(row[0] for row in rows)
+    if recursive:
+      for name in list(result):
+        result.update(self.get_dependents(name, True))
+    return sorted(result)
+
+  def get_affected(self, filenames=(), targets=()):
+    """
+    Returns a sorted list of the names of the targets that are affected by
+    changes to the *filenames*, that is the targets that read any of the
+    files, the specified *targets* and all targets that depend on them,
+    directly or indirectly.
+    """
+
+    result = set(targets)
+    for filename in set(filenames):
+      result.update(self.get_consumers(filename))
+    queue = list(result)
+    while queue:
+      for name in self.get_dependents(queue.pop()):
+        if name not in result:
+          result.add(name)
+          queue.append(name)
+    return sorted(result)
+
+  def get_owner(self, filename):
+    """
+    Returns the name of the target that produces *filename* or :const:`None`.
+    """
+
+    row = self.conn.execute('''
+      SELECT targets.name FROM files JOIN targets ON files.target = targets.id
+      WHERE files.filename = ? AND files.kind = 'output'
+    ''', (filename,)).fetchone()
+    return row[0] if row else None
+
+  def get_files(self, target, kind='output'):
+    """
+    Returns the list of files of the specified *kind* (see
+    :data:`FILE_KINDS`) of the *target*.
+    """
+
+    rows = self.conn.execute('''
+      SELECT files.filename FROM files JOIN targets ON files.target = targets.id
+      WHERE targets.name = ? AND files.kind = ? ORDER BY files.rowid
+    ''', (target, kind))
+    return [row[0] for row in rows]
+
+  def get_metadata(self, target):
+    """
+    Returns the metadata dictionary of the *target*. Values that could not
+    be serialised to JSON are represented by their :func:`repr`.
+    """
+
+    row = self.conn.execute('SELECT metadata FROM targets WHERE name = ?',
+      (target,)).fetchone()
+    return json.loads(row[0]) if row and row[0] else {}
+
+  def get_path(self, source, dest):
+    """
+    Returns the shortest chain of dependencies from the target *source* to
+    the target *dest* as a list of target names that starts with *source*
+    and ends with *dest*, or :const:`None` if *source* does not depend on
+    *dest*.
+    """
+
+    parents = {source: None}
+    queue = collections.deque([source])
+    while queue:
+      name = queue.popleft()
+      if name == dest:
+        result = []
+        while name is not None:
+          result.append(name)
+          name = parents[name]
+        return result[::-1]
+      for dep in self.get_dependencies(name):
+        if dep not in parents:
+          parents[dep] = name
+          queue.append(dep)
+    return None
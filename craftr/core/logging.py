@@ -20,6 +20,7 @@ import abc
 import contextlib
 import itertools
 import sys
+import threading
 import time
 import werkzeug
 
@@ -101,12 +102,21 @@ class DefaultLogger(BaseLogger):
     self._progress = None
     self._line_alive = False
     self._last_module_name = None
+    self._lock = threading.RLock()
 
   def log(self, level, *objects, sep=' ', end='\n', indent=0):
-    from craftr.core.session import session
-    module = session.module if session else None
     if level < self._level:
       return
+    with self._lock:
+      self._log(level, objects, sep, end, indent)
+
+  def _log(self, level, objects, sep, end, indent):
+    from craftr.core.session import session
+    # The current line of the module can only be determined from the
+    # thread that executes it (see :attr:`Module.current_line`).
+    module = None
+    if session and threading.current_thread() is threading.main_thread():
+      module = session.module
     width = tty.terminal_size()[0] - 1
     if self._progress:
       tty.clear_line()
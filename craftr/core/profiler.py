@@ -0,0 +1,265 @@
+# The Craftr build system
+# Copyright (C) 2016  Niklas Rosenstein
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+:mod:`craftr.core.profiler`
+===========================
+
+A lightweight profiler for the export phase. Code that should be profiled
+is wrapped in a :meth:`Profiler.section` or decorated with
+:meth:`Profiler.profile`. Sections are only recorded when the profiler is
+enabled (``craftr export --profile``), otherwise they cost a single
+attribute lookup.
+
+Sections can be nested. The *self time* of a section is its duration minus
+the duration of its nested sections, so the self time of a module does not
+include the modules that it loaded. Sections that are entered from other
+threads (eg. probes started with :func:`craftr.utils.shell.prefetch`) are
+nested per thread and do not count towards the sections of the main thread.
+
+When memory profiling is enabled (``craftr export --memprofile``), the
+:mod:`tracemalloc` module is used to record the memory that is retained by
+every section in the same way.
+"""
+
+import collections
+import contextlib
+import functools
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+
+class Event(collections.namedtuple('Event', 'category name start end memory args tid')):
+  """
+  A section that was recorded by the :class:`Profiler`. *start* and *end*
+  are :func:`time.perf_counter` values. *memory* is the number of bytes
+  retained by the section or :const:`None` if memory profiling is disabled
+  or the section was recorded in another thread than the main thread. *tid*
+  is 0 for the main thread and a sequential number for other threads.
+  """
+
+  __slots__ = ()
+
+  @property
+  def duration(self):
+    return self.end - self.start
+
+
+class Profiler(object):
+  """
+  Records the time spent in named sections of code. Every thread has its
+  own stack of sections. The memory retained by sections is only recorded
+  in the main thread, as :mod:`tracemalloc` can not tell threads apart.
+
+  .. attribute:: enabled
+
+    True if sections are being recorded.
+
+  .. attribute:: memory
+
+    True if the memory retained by sections is being recorded.
+
+  .. attribute:: events
+
+    A list of :class:`Event` objects in the order the sections were left.
+
+  .. attribute:: totals
+
+    A dictionary that maps ``(category, name)`` tuples to a list of
+    ``[total, self, count, memory_total, memory_self]``.
+
+  .. attribute:: snapshots
+
+    A list of ``(label, snapshot)`` tuples taken with :meth:`snapshot`.
+  """
+
+  def __init__(self):
+    self.enabled = False
+    self.memory = False
+    self.events = []
+    self.totals = {}
+    self.snapshots = []
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._tids = {}
+    self._wrappers = set()
+
+  def enable(self, memory=False):
+    """
+    Enable recording of sections. If *memory* is True, :mod:`tracemalloc`
+    is started and the memory retained by every section is recorded, too.
+    """
+
+    self.enabled = True
+    if memory and not self.memory:
+      self.memory = True
+      tracemalloc.start()
+      self.snapshot('start')
+
+  def disable(self):
+    self.enabled = False
+    if self.memory:
+      self.memory = False
+      tracemalloc.stop()
+
+  def snapshot(self, label):
+    """
+    Takes a :mod:`tracemalloc` snapshot and adds it to :attr:`snapshots`.
+    Does nothing if memory profiling is not enabled.
+    """
+
+    if self.memory:
+      snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__)])
+      self.snapshots.append((label, snapshot))
+
+  @contextlib.contextmanager
+  def section(self, category, name, **args):
+    """
+    Context manager that records the time spent in the block as a section
+    with the specified *category* and *name*. Additional keyword arguments
+    are stored in the :class:`Event`.
+    """
+
+    if not self.enabled:
+      yield
+      return
+
+    stack = getattr(self._local, 'stack', None)
+    if stack is None:
+      stack = self._local.stack = []
+    thread = threading.current_thread()
+    memory = self.memory and thread is threading.main_thread()
+    mem_start = tracemalloc.get_traced_memory()[0] if memory else 0
+    start = time.perf_counter()
+    stack.append([0.0, 0])
+    try:
+      yield
+    finally:
+      end = time.perf_counter()
+      duration = end - start
+      retained = tracemalloc.get_traced_memory()[0] - mem_start if memory else 0
+      children, mem_children = stack.pop()
+      if stack:
+        stack[-1][0] += duration
+        stack[-1][1] += retained
+      with self._lock:
+        if thread is threading.main_thread():
+          tid = 0
+        else:
+          tid = self._tids.setdefault(thread.ident, len(self._tids) + 1)
+        item = self.totals.setdefault((category, name), [0.0, 0.0, 0, 0, 0])
+        item[0] += duration
+        item[1] += duration - children
+        item[2] += 1
+        item[3] += retained
+        item[4] += retained - mem_children
+        self.events.append(Event(category, name, start, end,
+            retained if memory else None, args, tid))
+
+  def profile(self, category, name=None):
+    """
+    Decorator for a function that records every call as a section. The
+    *name* defaults to the qualified name of the function.
+
+    Note that the wrapper adds a frame to the call stack. Functions that
+    inspect the frame of their caller must skip it with
+    :meth:`skip_wrapper_frames`.
+    """
+
+    def decorator(func):
+      section_name = name or func.__qualname__
+      @functools.wraps(func)
+      def wrapper(*args, **kwargs):
+        if not self.enabled:
+          return func(*args, **kwargs)
+        with self.section(category, section_name):
+          return func(*args, **kwargs)
+      self._wrappers.add(wrapper.__code__)
+      return wrapper
+    return decorator
+
+  def skip_wrapper_frames(self, frame):
+    """
+    Returns the first frame starting from *frame* that does not belong to a
+    wrapper created with :meth:`profile`.
+    """
+
+    while frame is not None and frame.f_code in self._wrappers:
+      frame = frame.f_back
+    return frame
+
+  def get_totals(self, by_memory=False):
+    """
+    Returns a list of ``(category, name, total, self, count, memory_total,
+    memory_self)`` tuples sorted by the self time or, if *by_memory* is True,
+    by the retained memory, highest first.
+    """
+
+    result = [k + tuple(v) for k, v in self.totals.items()]
+    result.sort(key=lambda x: x[6] if by_memory else x[3], reverse=True)
+    return result
+
+  def get_top_allocations(self, limit=10, key_type='lineno'):
+    """
+    Compares the last snapshot with the first one and returns the *limit*
+    :class:`tracemalloc.StatisticDiff` objects with the largest growth.
+    """
+
+    if len(self.snapshots) < 2:
+      return []
+    first, last = self.snapshots[0][1], self.snapshots[-1][1]
+    return last.compare_to(first, key_type)[:limit]
+
+  @staticmethod
+  def get_peak_rss():
+    """
+    Returns the peak resident set size of the process in bytes or
+    :const:`None` if it can not be determined on this platform.
+    """
+
+    if resource is None:
+      return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, Mac OS reports bytes.
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+  def to_chrome_trace(self):
+    """
+    Converts the recorded :attr:`events` to the Chrome trace event format.
+    Returns a JSON serialisable dictionary.
+    """
+
+    events = []
+    begin = min((e.start for e in self.events), default=0.0)
+    for event in sorted(self.events, key=lambda x: (x.start, -x.end)):
+      events.append({
+        'name': event.name, 'cat': event.category, 'ph': 'X', 'pid': 0,
+        'tid': event.tid, 'ts': (event.start - begin) * 1e6,
+        'dur': event.duration * 1e6, 'args': dict(event.args,
+          **({'retained': event.memory} if event.memory is not None else {}))
+      })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+#: The global profiler instance.
+profiler = Profiler()
@@ -25,18 +25,25 @@ for the meta build process (such as a :class:`craftr.core.build.Graph`).
 from craftr.core import build, manifest, renames
 from craftr.core.logging import logger
 from craftr.core.manifest import Manifest
+from craftr.core.profiler import profiler
 from craftr.utils import argspec, path
 from nr.types.version import Version, VersionCriteria
 
 import json
+import marshal
 import os
+import struct
 import sys
 import tempfile
+import threading
 import types
 import werkzeug
 
 MANIFEST_FILENAMES = ['manifest.cson', 'manifest.json']
 
+#: The header of the binary cache file, see :meth:`Session.write_cache`.
+CACHE_MAGIC = b'CRAFTRCACHE\x01'
+
 
 class ModuleNotFound(Exception):
 
@@ -66,6 +73,58 @@ class InvalidOption(Exception):
           self.module.manifest.version, exc)
 
 
+def _audit_hook(event, args):
+  """
+  Audit hook that adds the files that are opened for reading while a module
+  is executed to the :attr:`Module.dependent_files`. Only files inside the
+  project directory of the module and outside of the build directory are
+  taken into account.
+  """
+
+  if event != 'open' or not session or not session.modulestack:
+    return
+  if threading.current_thread() is not threading.main_thread():
+    return
+  filename, mode, flags = args
+  if isinstance(filename, bytes):
+    filename = os.fsdecode(filename)
+  elif not isinstance(filename, str):
+    return  # file descriptor
+  if mode is None:
+    if flags & (os.O_WRONLY | os.O_RDWR):
+      return
+  elif any(c in mode for c in 'wax+'):
+    return
+  if filename.endswith('.pyc'):
+    return
+
+  module = session.module
+  filename = path.norm(filename)
+  project_dir = path.norm(module.project_dir)
+  builddir = path.norm(session.builddir)
+  if not filename.startswith(project_dir + os.sep):
+    return
+  if filename == builddir or filename.startswith(builddir + os.sep):
+    return
+  if os.path.isfile(filename):
+    module.add_dependent_file(filename)
+
+
+_audit_hook_installed = False
+
+def _install_audit_hook():
+  """
+  Installs :func:`_audit_hook` once. Audit hooks can not be removed, thus
+  the hook checks itself whether a module is being executed. Does nothing
+  on Python versions older than 3.8.
+  """
+
+  global _audit_hook_installed
+  if not _audit_hook_installed and hasattr(sys, 'addaudithook'):
+    sys.addaudithook(_audit_hook)
+    _audit_hook_installed = True
+
+
 class Session(object):
   """
   This class manages the :class:`build.Graph` and loading of Craftr modules.
@@ -124,13 +183,16 @@ class Session(object):
 
   .. attributes:: cache
 
-    A JSON object that will be loaded from the current workspace's cache
-    file and written back when Craftr exits without errors. The cache can
+    A JSON compatible dictionary that will be loaded from the current
+    workspace's cache file and written back when Craftr exits without
+    errors. The cache can
     contain anything and can be modified by everything, however it should
     be assured that no name conflicts and accidental modifications/deletes
     occur.
 
-    Reserved keywords in the cache are ``"build"`` and ``"loaders"``.
+    Reserved keywords in the cache are ``"build"``, ``"globs"`` (see
+    :func:`craftr.defaults.glob`), ``"loaders"`` and ``"tools"`` (see
+    :mod:`craftr.core.toolcache`).
   """
 
   #: The current session object. Create it with :meth:`start` and destroy
@@ -183,15 +245,74 @@ class Session(object):
       return self.modulestack[-1]
     return None
 
-  def read_cache(self, fp):
-    cache = json.load(fp)
-    if not isinstance(cache, dict):
-      raise ValueError('Craftr Session cache must be a JSON object, got {}'
-          .format(type(cache).__name__))
+  def read_cache(self, fp, sections=None):
+    """
+    Reads the :attr:`cache` from the binary file-like object *fp*. The
+    cache is stored in sections, one for every key of the cache, and only
+    the keys listed in *sections* are loaded if it is specified. Caches that
+    have been written as JSON by previous versions of Craftr can still be
+    read.
+
+    :raise ValueError: If the cache is invalid.
+    """
+
+    if fp.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+      fp.seek(0)
+      cache = json.loads(fp.read().decode('utf8'))
+      if not isinstance(cache, dict):
+        raise ValueError('Craftr Session cache must be a JSON object, got {}'
+            .format(type(cache).__name__))
+      if sections is not None:
+        cache = {k: v for k, v in cache.items() if k in sections}
+      self.cache = cache
+      return
+
+    try:
+      index_size = struct.unpack('<I', fp.read(4))[0]
+      index = marshal.loads(fp.read(index_size))
+      start = len(CACHE_MAGIC) + 4 + index_size
+      cache = {}
+      for key, (offset, size) in index.items():
+        if sections is None or key in sections:
+          fp.seek(start + offset)
+          cache[key] = marshal.loads(fp.read(size))
+    except (struct.error, EOFError, TypeError) as exc:
+      raise ValueError(exc)
     self.cache = cache
 
   def write_cache(self, fp):
-    json.dump(self.cache, fp, indent='\t')
+    """
+    Writes the :attr:`cache` to the binary file-like object *fp*. The
+    values must be JSON compatible. Use :meth:`dump_cache` to get a
+    readable representation.
+    """
+
+    index = {}
+    sections = []
+    offset = 0
+    for key, value in self.cache.items():
+      try:
+        data = marshal.dumps(value)
+      except ValueError:
+        # marshal only supports the exact built-in types, convert subclasses
+        # like OrderedDict to them.
+        data = marshal.dumps(json.loads(json.dumps(value)))
+      index[str(key)] = (offset, len(data))
+      sections.append(data)
+      offset += len(data)
+    index = marshal.dumps(index)
+    fp.write(CACHE_MAGIC)
+    fp.write(struct.pack('<I', len(index)))
+    fp.write(index)
+    for data in sections:
+      fp.write(data)
+
+  def dump_cache(self, fp):
+    """
+    Writes the :attr:`cache` as JSON to the text file-like object *fp*.
+    """
+
+    json.dump(self.cache, fp, indent=2, sort_keys=True)
 
   def expand_relative_options(self, module_name=None):
     """
@@ -226,6 +347,7 @@ class Session(object):
       logger.debug('created temporary directory:', self._tempdir)
     return self._tempdir
 
+  @profiler.profile('manifest')
   def parse_manifest(self, filename):
     """
     Parse a manifest by filename and add register the module to the module
@@ -259,6 +381,7 @@ class Session(object):
 
     return module
 
+  @profiler.profile('manifest')
   def update_manifest_cache(self, force=False):
     if not self._refresh_cache and not force:
       return
@@ -387,7 +510,10 @@ class Module(object):
     is generated when the module is executed with :func:`run`. By default,
     it contains at least the filename of the :attr:`manifest` and the script
     file that is executed for the Module. Additional files might be added
-    by some built-in functions like :func:`craftr.defaults.load_file`.
+    by some built-in functions like :func:`craftr.defaults.load_file` or
+    with :meth:`add_dependent_file`. On Python 3.8 and newer, every file
+    inside the :attr:`project_dir` that is opened for reading while the
+    module is executed is added automatically (see :func:`sys.addaudithook`).
 
   .. attribute:: dependencies
 
@@ -424,6 +550,16 @@ class Module(object):
   def scriptfile(self):
     return path.norm(path.join(self.directory, self.manifest.main))
 
+  def add_dependent_file(self, filename):
+    """
+    Adds *filename* to the :attr:`dependent_files` if it is not already
+    listed. The filename is normalized with :func:`path.norm`.
+    """
+
+    filename = path.norm(filename)
+    if filename not in self.dependent_files:
+      self.dependent_files.append(filename)
+
   def init_options(self, recursive=False, _break_recursion=None):
     """
     Initialize the :attr:`options` member. Requires an active session context.
@@ -467,6 +603,7 @@ class Module(object):
     if self.executed:
       raise RuntimeError('already run')
 
+    _install_audit_hook()
     self.executed = True
     self.dependent_files = []
     self.dependencies = {}
@@ -476,8 +613,8 @@ class Module(object):
     with open(script_fn) as fp:
       code = compile(fp.read(), script_fn, 'exec')
 
-    self.dependent_files.append(self.manifest.filename)
-    self.dependent_files.append(script_fn)
+    self.add_dependent_file(self.manifest.filename)
+    self.add_dependent_file(script_fn)
 
     from craftr.defaults import ModuleReturn
 
@@ -487,7 +624,8 @@ class Module(object):
     self.namespace.__version__ = str(self.manifest.version)
     try:
       session.modulestack.append(self)
-      exec(code, vars(self.namespace))
+      with profiler.section('module', self.ident):
+        exec(code, vars(self.namespace))
     except ModuleReturn:
       pass
     finally:
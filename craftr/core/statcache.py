@@ -0,0 +1,155 @@
+# The Craftr build system
+# Copyright (C) 2016  Niklas Rosenstein
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+:mod:`craftr.core.statcache`
+============================
+
+Content based change detection for the files that a module depends on.
+The :class:`StatCache` maps filenames to their modification time, size,
+inode and a hash of their contents, much like the index of Git. The hash
+of a file is only recomputed if its stat information changed, files that
+need to be hashed are processed in parallel.
+
+The hash of a directory is computed from the names of its entries, thus it
+changes when files are added or removed.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import time
+
+#: The name of the stat cache file in the build directory.
+FILENAME = '.craftrstat'
+
+#: Files that have been modified less than this number of nanoseconds
+#: before the cache was saved are hashed again the next time, because they
+#: could be modified again without changing their modification time.
+RACY_WINDOW = 2 * 10**9
+
+
+def hash_file(filename):
+  """
+  Returns the SHA-1 hex digest of the contents of *filename* or of the
+  sorted entry names if it is a directory.
+  """
+
+  hasher = hashlib.sha1()
+  if os.path.isdir(filename):
+    for name in sorted(os.listdir(filename)):
+      hasher.update(name.encode('utf8', 'surrogateescape') + b'\0')
+  else:
+    with open(filename, 'rb') as fp:
+      for chunk in iter(lambda: fp.read(65536), b''):
+        hasher.update(chunk)
+  return hasher.hexdigest()
+
+
+class StatCache(object):
+  """
+  Maps filenames to ``[mtime_ns, size, inode, hash]`` lists. Use
+  :meth:`get_hashes` to retrieve the up-to-date content hashes of files and
+  :meth:`save` to write the cache back.
+
+  :param filename: The filename of the cache. The cache is empty if the
+    file does not exist or can not be read.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.modified = False
+    self._used = set()
+    try:
+      with open(filename) as fp:
+        self.entries = json.load(fp)
+      if not isinstance(self.entries, dict):
+        raise ValueError('expected JSON object')
+    except (OSError, ValueError):
+      self.entries = {}
+
+  def get_hashes(self, filenames, max_workers=None):
+    """
+    Returns a dictionary that maps every filename in *filenames* to the hash
+    of its contents or :const:`None` if the file does not exist. Files whose
+    stat information matches the cache entry are not hashed again.
+    """
+
+    result = {}
+    pending = {}
+    for filename in set(filenames):
+      self._used.add(filename)
+      try:
+        st = os.stat(filename)
+      except OSError:
+        result[filename] = None
+        continue
+      key = [st.st_mtime_ns, st.st_size, st.st_ino]
+      entry = self.entries.get(filename)
+      if entry is not None and entry[:3] == key:
+        result[filename] = entry[3]
+      else:
+        pending[filename] = key
+
+    if pending:
+      with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = {filename: executor.submit(hash_file, filename) for filename in pending}
+        for filename, future in futures.items():
+          try:
+            result[filename] = future.result()
+          except OSError:
+            result[filename] = None
+            continue
+          self.entries[filename] = pending[filename] + [result[filename]]
+      self.modified = True
+
+    return result
+
+  def get_digest(self, filenames):
+    """
+    Returns a single SHA-1 hex digest for the names and contents of all
+    *filenames*.
+    """
+
+    hashes = self.get_hashes(filenames)
+    hasher = hashlib.sha1()
+    for filename in sorted(hashes):
+      hasher.update('{}\0{}\0'.format(filename, hashes[filename]).encode('utf8', 'surrogateescape'))
+    return hasher.hexdigest()
+
+  def save(self):
+    """
+    Writes the cache back to its file if it has been modified. Entries of
+    files that have been modified very recently are invalidated (see
+    :data:`RACY_WINDOW`), entries of files that have not been passed to
+    :meth:`get_hashes` are removed.
+    """
+
+    if not self.modified:
+      return
+    threshold = int(time.time() * 10**9) - RACY_WINDOW
+    for filename in list(self.entries):
+      entry = self.entries[filename]
+      if filename not in self._used:
+        del self.entries[filename]
+      elif entry[0] is not None and entry[0] >= threshold:
+        entry[:3] = [None, None, None]
+
+    tempfile = self.filename + '.tmp'
+    with open(tempfile, 'w') as fp:
+      json.dump(self.entries, fp)
+    os.replace(tempfile, self.filename)
+    self.modified = False
@@ -0,0 +1,197 @@
+# The Craftr build system
+# Copyright (C) 2016  Niklas Rosenstein
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+:mod:`craftr.core.stats`
+========================
+
+This module implements the build statistics database that Craftr keeps in
+the build directory. After every build, the duration of every target that
+was built is recorded, as well as the number of targets that were up to
+date. Exports are recorded with their duration. The database can then be
+queried for trends and regressions with the ``craftr stats`` command.
+"""
+
+import re
+import sqlite3
+import time
+
+#: The name of the statistics database file in the build directory.
+FILENAME = '.craftrstats'
+
+
+class StatsDatabase(object):
+  """
+  Wrapper for the SQLite build statistics database.
+
+  :param filename: The filename of the database. Will be created if it
+    does not exist.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.conn = sqlite3.connect(filename)
+    self.conn.executescript('''
+      CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        time REAL NOT NULL,
+        duration REAL NOT NULL,
+        built INTEGER NOT NULL DEFAULT 0,
+        up_to_date INTEGER NOT NULL DEFAULT 0
+      );
+      CREATE TABLE IF NOT EXISTS durations (
+        run INTEGER NOT NULL REFERENCES runs(id),
+        target TEXT NOT NULL,
+        module TEXT NOT NULL,
+        generator TEXT,
+        duration REAL NOT NULL
+      );
+      CREATE INDEX IF NOT EXISTS durations_target ON durations (target, run);
+      CREATE INDEX IF NOT EXISTS durations_module ON durations (module, run);
+    ''')
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.conn.close()
+
+  def add_build(self, durations, up_to_date, generators=None, timestamp=None):
+    """
+    Records a build in the database.
+
+    :param durations: A dictionary that maps the names of the targets that
+      have been built to their duration in seconds.
+    :param up_to_date: The number of targets that did not need to be built.
+    :param generators: A dictionary that maps target names to the name of
+      their target generator.
+    :param timestamp: The time of the build. Defaults to the current time.
+    :return: The ID of the run.
+    """
+
+    generators = generators or {}
+    with self.conn:
+      cursor = self.conn.execute(
+        'INSERT INTO runs (kind, time, duration, built, up_to_date) VALUES (?, ?, ?, ?, ?)',
+        ('build', timestamp or time.time(), sum(durations.values()),
+          len(durations), up_to_date))
+      run = cursor.lastrowid
+      self.conn.executemany(
+        'INSERT INTO durations (run, target, module, generator, duration) VALUES (?, ?, ?, ?, ?)',
+        [(run, name, name.rpartition('.')[0], generators.get(name), duration)
+          for name, duration in durations.items()])
+    return run
+
+  def add_export(self, duration, targets, timestamp=None):
+    """
+    Records an export that took *duration* seconds and generated the
+    number of *targets*. Returns the ID of the run.
+    """
+
+    with self.conn:
+      cursor = self.conn.execute(
+        'INSERT INTO runs (kind, time, duration, built) VALUES (?, ?, ?, ?)',
+        ('export', timestamp or time.time(), duration, targets))
+    return cursor.lastrowid
+
+  def get_runs(self, kind=None, limit=20):
+    """
+    Returns a list of the last *limit* runs as tuples of ``(id, kind, time,
+    duration, built, up_to_date)``, most recent first.
+    """
+
+    query = 'SELECT id, kind, time, duration, built, up_to_date FROM runs'
+    params = []
+    if kind:
+      query += ' WHERE kind = ?'
+      params.append(kind)
+    query += ' ORDER BY id DESC LIMIT ?'
+    params.append(limit)
+    return self.conn.execute(query, params).fetchall()
+
+  def get_trend(self, target=None, module=None, limit=20):
+    """
+    Returns the durations of the *target* or the total duration of all
+    targets in *module* for the last *limit* builds that built it, as a list
+    of tuples ``(run, time, duration, count)``, most recent first.
+    """
+
+    if (target is None) == (module is None):
+      raise ValueError('expected either target or module')
+    column, value = ('target', target) if target is not None else ('module', module)
+    return self.conn.execute('''
+      SELECT runs.id, runs.time, SUM(durations.duration), COUNT(*)
+      FROM durations JOIN runs ON runs.id = durations.run
+      WHERE durations.{} = ?
+      GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?
+    '''.format(column), (value, limit)).fetchall()
+
+  def find_targets(self, name):
+    """
+    Returns a list of all target names in the database that are equal to
+    *name* or end with ``"." + name``.
+    """
+
+    rows = self.conn.execute(
+      "SELECT DISTINCT target FROM durations WHERE target = ? OR target LIKE ? ESCAPE '\\'",
+      (name, '%.' + _escape_like(name)))
+    return [row[0] for row in rows]
+
+  def find_modules(self, name):
+    """
+    Returns a list of all module identifiers in the database that are equal
+    to *name* or that are a version of the module *name*.
+    """
+
+    rows = self.conn.execute(
+      "SELECT DISTINCT module FROM durations WHERE module = ? OR module LIKE ? ESCAPE '\\'",
+      (name, _escape_like(name) + '-%'))
+    return [row[0] for row in rows]
+
+  def find_regressions(self, threshold=1.25, window=5, min_delta=0.1):
+    """
+    Compares the most recent duration of every target with the mean of the
+    *window* durations recorded before it (the rolling baseline). Returns a
+    list of tuples ``(target, duration, baseline)`` for all targets whose
+    duration exceeds the baseline by the factor *threshold* and by at least
+    *min_delta* seconds, sorted by the increase.
+    """
+
+    result = []
+    targets = self.conn.execute('SELECT DISTINCT target FROM durations')
+    for (target,) in targets.fetchall():
+      rows = self.conn.execute(
+        'SELECT duration FROM durations WHERE target = ? ORDER BY run DESC LIMIT ?',
+        (target, window + 1)).fetchall()
+      if len(rows) < 2:
+        continue
+      duration = rows[0][0]
+      baseline = sum(row[0] for row in rows[1:]) / (len(rows) - 1)
+      if duration > baseline * threshold and duration - baseline >= min_delta:
+        result.append((target, duration, baseline))
+    result.sort(key=lambda x: x[1] - x[2], reverse=True)
+    return result
+
+
+def _escape_like(value):
+  """
+  Escapes the wildcards of a SQL ``LIKE`` pattern in *value*.
+  """
+
+  return re.sub(r'([\\%_])', r'\\\1', value)
@@ -0,0 +1,90 @@
+# The Craftr build system
+# Copyright (C) 2016  Niklas Rosenstein
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+:mod:`craftr.core.toolcache`
+============================
+
+Persistent cache for the results of tool detection functions (eg. the
+compiler version detection). Spawning a compiler to find its version is
+slow and the result only changes when the program is replaced, so the
+results are saved in the ``"tools"`` key of the :attr:`Session.cache`.
+
+A cached result is only used if the resolved path of the program, its
+modification time and size and the values of the relevant environment
+variables did not change since the result was saved.
+"""
+
+from craftr.core.logging import logger
+from craftr.core.session import session
+from craftr.utils import shell
+
+import functools
+import json
+import os
+
+
+def get_program_key(program):
+  """
+  Returns a JSON serialisable key for *program*, which may be a program name
+  or a command string with additional arguments. The key contains the
+  real path of the program, its modification time and size. Returns
+  :const:`None` if the program can not be found.
+  """
+
+  args = shell.split(program)
+  if not args:
+    return None
+  try:
+    filename = os.path.realpath(shell.find_program(args[0]))
+    st = os.stat(filename)
+  except OSError:
+    return None
+  return [filename, args[1:], st.st_mtime_ns, st.st_size]
+
+
+def cached(name, env=()):
+  """
+  Decorator for a tool detection function that accepts the program as its
+  first argument and returns a JSON serialisable result. The result is saved
+  in the session cache under *name* and the program. The names of
+  environment variables that influence the result can be specified with
+  *env*.
+
+  Exceptions raised by the function are not cached. Additional arguments
+  must be JSON serialisable, every combination of arguments is cached
+  separately.
+  """
+
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(program, *args):
+      key = get_program_key(program)
+      if key is None or not session:
+        return func(program, *args)
+      # Round-trip through JSON so that the key compares equal to the
+      # one loaded from the cache (eg. tuples become lists).
+      key = json.loads(json.dumps(key + [list(args), {k: os.getenv(k) for k in env}]))
+      entry_name = json.dumps([program] + key[-2]) if args else program
+      cache = session.cache.setdefault('tools', {}).setdefault(name, {})
+      entry = cache.get(entry_name)
+      if entry is not None and entry.get('key') == key:
+        logger.debug('{}("{}"): using cached result'.format(name, program))
+        return entry['result']
+      result = func(program, *args)
+      cache[entry_name] = {'key': key, 'result': result}
+      return result
+    return wrapper
+  return decorator
@@ -24,6 +24,7 @@ starting with an underscore will be ignored.
 from craftr.core import build as _build
 from craftr.core.logging import logger
 from craftr.core.manifest import Namespace
+from craftr.core.profiler import profiler as _profiler
 from craftr.core.session import session, ModuleNotFound
 from craftr.utils import path, shell
 from craftr.targetbuilder import gtn, TargetBuilder, Framework
@@ -32,6 +33,7 @@ from nr.types.singleton import Default
 
 import builtins as _builtins
 import itertools as _itertools
+import json as _json
 import os as _os
 import sys as _sys
 
@@ -56,13 +58,51 @@ def glob(patterns, parent=None, exclude=(), include_dotfiles=False, ignore_false
   Wrapper for :func:`path.glob` that automatically uses the current modules
   project directory for the *parent* argument if it has not been specifically
   set.
+
+  The result is saved in the ``"globs"`` key of the :attr:`Session.cache`
+  together with the modification times of the directories that have been
+  read, and reused until one of these directories changes. The directories
+  are added to the :attr:`Module.dependent_files`, thus adding or removing
+  a file that could be matched marks the module as changed.
   """
 
   if parent is None and session and session.module:
     parent = session.module.namespace.project_dir
-
-  return path.glob(patterns, parent, exclude, include_dotfiles,
-    ignore_false_excludes)
+  if not session:
+    return path.glob(patterns, parent, exclude, include_dotfiles,
+      ignore_false_excludes)
+
+  key = _json.dumps([patterns, parent, exclude, include_dotfiles, ignore_false_excludes])
+  cache = session.cache.setdefault('globs', {})
+  entry = cache.get(key)
+  if entry is None or any(_get_dir_mtime(k) != v for k, v in entry['dirs'].items()):
+    visited = []
+    result = path.glob(patterns, parent, exclude, include_dotfiles,
+      ignore_false_excludes, visited)
+    entry = {'dirs': {k: _get_dir_mtime(k) for k in visited}, 'result': result}
+    cache[key] = entry
+
+  if session.module:
+    # The build directory changes on every export and build, depending on
+    # it would mark the module as changed every time.
+    builddir = path.norm(session.builddir)
+    for dirname, mtime in entry['dirs'].items():
+      # A directory that does not exist would always be reported as
+      # changed, depend on the parent in which it would be created.
+      while mtime is None and dirname != path.dirname(dirname):
+        dirname = path.dirname(dirname)
+        mtime = _get_dir_mtime(dirname)
+      if dirname == builddir or dirname.startswith(builddir + _os.sep):
+        continue
+      session.module.add_dependent_file(dirname)
+  return list(entry['result'])
+
+
+def _get_dir_mtime(dirname):
+  try:
+    return _os.stat(dirname).st_mtime_ns
+  except OSError:
+    return None
 
 
 def local(rel_path):
@@ -215,7 +255,7 @@ def load_file(filename, export_default_namespace=True):
     filename = path.join(module.directory, filename)
   filename = path.norm(filename)
 
-  module.dependent_files.append(filename)
+  module.add_dependent_file(filename)
   with open(filename, 'r') as fp:
     code = compile(fp.read(), filename, 'exec')
 
@@ -257,12 +297,16 @@ def gentool(commands, preamble=None, environ=None, name=None):
   return tool
 
 
+@_profiler.profile('generator')
 def gentarget(commands, inputs=(), outputs=(), *args, **kwargs):
   """
   Create a :class:`~_build.Target` object. The name of the target will be
   derived from the variable name it is assigned to unless *name* is specified.
+  Pass ``restat=True`` if the *commands* do not touch output files whose
+  content did not change.
   """
 
+  kwargs.setdefault('generator', 'gentarget')
   target = _build.Target(gtn(kwargs.pop('name', None)), commands, inputs,
       outputs, *args, **kwargs)
   session.graph.add_target(target)
@@ -298,15 +342,18 @@ def gentask(func, args = None, inputs = (), outputs = (), name = None, **kwargs)
   :param inputs: A list of input files.
   :param inputs: A list of output files.
   :param name: Alternative target name.
-  :param kwargs: Additional parameters for the :class:`Task` constructor.
+  :param kwargs: Additional parameters for the :class:`Target` constructor.
+    Pass ``restat=True`` if *func* writes its outputs with
+    :func:`path.write_if_changed`.
   :return: A :class:`Target` object.
   """
 
   if args is None:
     args = [inputs, outputs]
-  builder = TargetBuilder(gtn(name), inputs = inputs)
+  builder = TargetBuilder(gtn(name), inputs = inputs, generator = 'gentask')
   task = _build.Task(builder.name, func, args)
-  return session.graph.add_task(task, inputs = builder.inputs, outputs = outputs)
+  return session.graph.add_task(task, inputs = builder.inputs, outputs = outputs,
+      generator = builder.generator, **kwargs)
 
 
 def task(inputs = (), outputs = (), args = None, **kwargs):
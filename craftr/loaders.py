@@ -16,6 +16,7 @@
 
 __all__ = ['external_file', 'external_archive']
 
+from craftr.core.profiler import profiler
 from craftr.defaults import buildlocal, gtn, logger, session, Framework, path, shell
 from craftr.utils import httputils, pyutils
 
@@ -247,6 +248,7 @@ class PkgConfigError(Exception):
   pass
 
 
+@profiler.profile('probe')
 def pkg_config(pkg_name, static = False):
   """
   If available, this function uses ``pkg-config`` to extract flags for
@@ -22,6 +22,7 @@ Provides the :class:`TargetBuilder` and :class:`Framework` classes.
 
 from craftr.core import build
 from craftr.core.logging import logger
+from craftr.core.profiler import profiler
 from craftr.core.session import session
 from craftr.utils import argspec, pyutils
 from nr.py.bytecode import get_assigned_name
@@ -29,6 +30,16 @@ from nr.types.version import Version
 
 import collections
 import sys
+import weakref
+
+#: Caches the results of :func:`get_assigned_name` by the code object and
+#: the instruction offset of the calling frame. Failures are cached as the
+#: :class:`ValueError` that was raised.
+_assigned_names = {}
+
+#: Maps :class:`Module` objects to a dictionary of the next index to try
+#: for every name hint.
+_name_counters = weakref.WeakKeyDictionary()
 
 
 def get_full_name(target_name, module=None, module_name=None, version=None):
@@ -54,6 +65,20 @@ def get_full_name(target_name, module=None, module_name=None, version=None):
   return '{}-{}.{}'.format(module_name, version, target_name)
 
 
+def get_generator_name(frame):
+  """
+  Returns the name of the target generator function that is executed in
+  *frame*. For methods, the name of the class is prepended (eg.
+  ``"CompilerLinker.compile"``).
+  """
+
+  name = frame.f_code.co_name
+  self = frame.f_locals.get('self')
+  if self is not None:
+    name = type(self).__name__ + '.' + name
+  return name
+
+
 def gtn(target_name=None, name_hint=NotImplemented):
   """
   This function is mandatory in combination with the :class:`TargetBuilder`
@@ -95,12 +120,28 @@ def gtn(target_name=None, name_hint=NotImplemented):
   if not module:
     raise RuntimeError('no current module')
 
+  if not profiler.enabled:
+    return _gtn(module, target_name, name_hint)
+  with profiler.section('gtn', 'gtn'):
+    return _gtn(module, target_name, name_hint)
+
+
+def _gtn(module, target_name, name_hint):
   if target_name is None:
+    frame = profiler.skip_wrapper_frames(sys._getframe(3))
+    key = (frame.f_code, frame.f_lasti)
     try:
-      target_name = get_assigned_name(sys._getframe(2))
-    except ValueError:
+      target_name = _assigned_names[key]
+    except KeyError:
+      try:
+        target_name = get_assigned_name(frame)
+      except ValueError as exc:
+        target_name = exc
+      _assigned_names[key] = target_name
+    if isinstance(target_name, ValueError):
       if name_hint is NotImplemented:
-        raise
+        raise ValueError(*target_name.args)
+      target_name = None
   elif '-' in target_name:
     # TODO: We should find a better way to determine if the target is
     # TODO: already an absolute target name.
@@ -111,13 +152,17 @@ def gtn(target_name=None, name_hint=NotImplemented):
     if name_hint is None:
       return None
 
-    index = 0
+    # Continue where the last generated name for this hint left off, names
+    # can still be taken by targets that have been named explicitly.
+    counters = _name_counters.setdefault(module, {})
+    index = counters.get(name_hint, 0)
     while True:
       target_name = '{}_{:0>4}'.format(name_hint, index)
       full_name = get_full_name(target_name, module)
+      index += 1
       if full_name not in session.graph.targets:
         break
-      index += 1
+    counters[name_hint] = index
 
   if full_name is None:
     full_name = get_full_name(target_name, module)
@@ -145,10 +190,12 @@ class TargetBuilder(object):
   :param outputs: A list of output filenames.
   :param implicit_deps: A list of filenames added as implicit dependencies.
   :param order_only_deps: A list of filenames added as order only dependencies.
+  :param generator: The name of the target generator. Derived from the
+    function that creates the builder if omitted.
   """
 
   def __init__(self, name, option_kwargs=None, frameworks=(), inputs=(),
-      outputs=(), implicit_deps=(), order_only_deps=()):
+      outputs=(), implicit_deps=(), order_only_deps=(), generator=None):
     argspec.validate('name', name, {'type': str})
     argspec.validate('option_kwargs', option_kwargs,
         {'type': [None, dict, Framework]})
@@ -198,12 +245,14 @@ class TargetBuilder(object):
     self.name = name
     self.outputs = list(outputs)
     self.metadata = {}
+    self.generator = generator or get_generator_name(sys._getframe(1))
     self.used_option_keys = set()
 
     self.option_kwargs = Framework(name, **option_kwargs)
     self.option_kwargs_defaults = Framework(name + "_defaults")
     self.options_merge = OptionMerge(self.option_kwargs,
-        self.option_kwargs_defaults, *self.frameworks)
+        self.option_kwargs_defaults)
+    self.options_merge.extend(self.frameworks)
     assert self.option_kwargs in self.options_merge.frameworks
 
   def get(self, key, default=None):
@@ -255,6 +304,7 @@ class TargetBuilder(object):
         raise TypeError('expected Target or str in "implicit_deps", found {}'
             .format(type(item).__name__))
 
+    kwargs.setdefault('generator', self.generator)
     target = build.Target(self.name, commands, inputs, outputs, implicit_deps,
         order_only_deps, metadata=metadata, frameworks=self.frameworks, **kwargs)
     session.graph.add_target(target)
@@ -287,7 +337,8 @@ class OptionMerge(object):
 
   def __init__(self, *frameworks):
     self.frameworks = []
-    [self.append(x) for x in frameworks]
+    self._ids = set()
+    self._add(_flatten_frameworks(frameworks))
 
   def __getitem__(self, key):
     for options in self.frameworks:
@@ -297,13 +348,24 @@ class OptionMerge(object):
         pass  # intentional
     raise KeyError(key)
 
+  def _add(self, frameworks):
+    for fw in frameworks:
+      if id(fw) not in self._ids:
+        self._ids.add(id(fw))
+        self.frameworks.append(fw)
+
   def append(self, framework):
-    def update(fw):
-      if not isinstance(framework, Framework):
-        raise TypeError('expected Framework, got {}'.format(type(fw).__name__))
-      pyutils.unique_append(self.frameworks, fw, id_compare=True)
-      [update(x) for x in fw.get('frameworks', [])]
-    update(framework)
+    self._add(_flatten_frameworks([framework]))
+
+  def extend(self, frameworks):
+    """
+    Appends all *frameworks* and the frameworks listed in their
+    ``'frameworks'`` key. Unlike :meth:`append`, the flattened list is
+    cached and shared between all merges that are extended with the same
+    sequence of frameworks (see :func:`flatten_frameworks`).
+    """
+
+    self._add(flatten_frameworks(frameworks))
 
   def get(self, key, default=None):
     try:
@@ -326,6 +388,54 @@ class OptionMerge(object):
         continue
       if not isinstance(value, collections.Sequence):
         raise ValueError('found "{}" for key "{}" which is a non-sequence'
-            .format(tpye(value).__name__, key))
+            .format(type(value).__name__, key))
       result += value
     return result
+
+
+#: Maps tuples of :class:`Framework` IDs to a tuple of the frameworks,
+#: the flattened frameworks and the ``'frameworks'`` lists they depend on.
+_flattened = {}
+
+
+def flatten_frameworks(frameworks):
+  """
+  Returns a tuple of the *frameworks* and all frameworks listed in their
+  ``'frameworks'`` key, recursively, in the order of their first occurence.
+
+  The result is cached for the sequence of frameworks and re-computed only
+  if the ``'frameworks'`` list of one of the frameworks in the result has
+  been replaced or changed its length.
+  """
+
+  frameworks = tuple(frameworks)
+  key = tuple(map(id, frameworks))
+  entry = _flattened.get(key)
+  if entry is not None and all(a is b for a, b in zip(entry[0], frameworks)):
+    if all(fw.get('frameworks') is lst and (lst is None or len(lst) == n)
+        for fw, lst, n in entry[2]):
+      return entry[1]
+
+  result = _flatten_frameworks(frameworks)
+  deps = []
+  for fw in result:
+    lst = fw.get('frameworks')
+    deps.append((fw, lst, None if lst is None else len(lst)))
+  _flattened[key] = (frameworks, result, deps)
+  return result
+
+
+def _flatten_frameworks(frameworks):
+  result = []
+  seen = set()
+  stack = list(reversed(frameworks))
+  while stack:
+    fw = stack.pop()
+    if id(fw) in seen:
+      continue
+    if not isinstance(fw, Framework):
+      raise TypeError('expected Framework, got {}'.format(type(fw).__name__))
+    seen.add(id(fw))
+    result.append(fw)
+    stack.extend(reversed(fw.get('frameworks') or ()))
+  return tuple(result)
@@ -0,0 +1,216 @@
+# The Craftr build system
+# Copyright (C) 2016  Niklas Rosenstein
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+:mod:`craftr.utils.ninjadeps`
+=============================
+
+Parser for the binary ``.ninja_deps`` file in which Ninja records the
+header dependencies that it reads from depfiles (``deps = gcc``) or from
+the output of MSVC (``deps = msvc``). The file starts with a signature and
+a version number, followed by a sequence of records. Every record starts
+with a 32-bit size whose highest bit tells whether it is a path record or
+a dependency record:
+
+- A path record assigns the next node ID to a filename. The filename is
+  padded with null bytes to a multiple of four bytes and followed by the
+  complement of the node ID as a checksum.
+- A dependency record contains the node ID of an output, its modification
+  time (32 bit in version 3, 64 bit in version 4) and the node IDs of its
+  dependencies. A later record for the same output replaces the earlier one.
+
+Versions 3 and 4 are supported, the file is read with :mod:`mmap`.
+"""
+
+from craftr.utils import path
+
+import collections
+import mmap
+import os
+import struct
+
+#: The signature at the start of a ``.ninja_deps`` file.
+SIGNATURE = b'# ninjadeps\n'
+
+#: The versions of the file format that can be read.
+SUPPORTED_VERSIONS = (3, 4)
+
+_uint32 = struct.Struct('<I')
+
+
+class DepsLog(object):
+  """
+  The contents of a ``.ninja_deps`` file.
+
+  .. attribute:: paths
+
+    A list of all filenames in the log, indexed by their node ID.
+
+  .. attribute:: deps
+
+    A dictionary that maps the node ID of every output to a tuple of the
+    node IDs of its dependencies.
+
+  .. attribute:: mtimes
+
+    A dictionary that maps the node ID of every output to its modification
+    time as recorded by Ninja.
+  """
+
+  def __init__(self, paths=None, deps=None, mtimes=None):
+    self.paths = paths or []
+    self.deps = deps or {}
+    self.mtimes = mtimes or {}
+    self._ids = None
+    self._dependents = None
+
+  def __len__(self):
+    return len(self.deps)
+
+  def _get_id(self, filename):
+    if self._ids is None:
+      self._ids = {name: index for index, name in enumerate(self.paths)}
+    return self._ids.get(filename)
+
+  def items(self):
+    """
+    Iterates over ``(output, dependencies)`` pairs where *dependencies* is a
+    list of filenames.
+    """
+
+    paths = self.paths
+    for output, deps in self.deps.items():
+      yield paths[output], [paths[x] for x in deps]
+
+  def get_dependencies(self, output):
+    """
+    Returns the list of dependencies that Ninja recorded for *output*, or
+    :const:`None` if there is no record for it.
+    """
+
+    node = self._get_id(output)
+    if node is None or node not in self.deps:
+      return None
+    return [self.paths[x] for x in self.deps[node]]
+
+  def get_dependents(self, filename):
+    """
+    Returns a sorted list of the outputs that depend on *filename*, for
+    example the object files that include a header.
+    """
+
+    if self._dependents is None:
+      self._dependents = collections.defaultdict(list)
+      for output, deps in self.deps.items():
+        for node in deps:
+          self._dependents[node].append(output)
+    node = self._get_id(filename)
+    if node is None:
+      return []
+    return sorted(self.paths[x] for x in self._dependents.get(node, ()))
+
+  def get_fan_in(self, n=None):
+    """
+    Returns a list of ``(filename, count)`` tuples for the *n* dependencies
+    with the most outputs depending on them (all if *n* is :const:`None`),
+    highest count first. A change to a header with a high fan-in causes
+    many files to be recompiled.
+    """
+
+    counter = collections.Counter()
+    for deps in self.deps.values():
+      counter.update(deps)
+    return [(self.paths[node], count) for node, count in counter.most_common(n)]
+
+
+def parse(data, parent=None):
+  """
+  Parses the contents of a ``.ninja_deps`` file from the buffer *data* (eg.
+  a :class:`bytes` or :class:`mmap.mmap` object) and returns a
+  :class:`DepsLog`. Relative filenames are normalized with *parent* if it is
+  specified. Like Ninja, parsing stops at a truncated or invalid record.
+
+  :raise ValueError: If the signature or the version is not supported.
+  """
+
+  if data[:len(SIGNATURE)] != SIGNATURE or len(data) < len(SIGNATURE) + 4:
+    raise ValueError('not a ninja deps log')
+  version = _uint32.unpack_from(data, len(SIGNATURE))[0]
+  if version not in SUPPORTED_VERSIONS:
+    raise ValueError('unsupported ninja deps log version: {}'.format(version))
+  header_size = 3 if version >= 4 else 2
+
+  paths = []
+  deps = {}
+  mtimes = {}
+  offset = len(SIGNATURE) + 4
+  end = len(data)
+  while offset + 4 <= end:
+    size = _uint32.unpack_from(data, offset)[0]
+    is_deps = size & 0x80000000
+    size &= 0x7fffffff
+    offset += 4
+    if size % 4 or offset + size > end:
+      break
+    if is_deps:
+      count = size // 4 - header_size
+      if count < 0:
+        break
+      values = struct.unpack_from('<{}I'.format(size // 4), data, offset)
+      output = values[0]
+      if version >= 4:
+        mtime = values[1] | (values[2] << 32)
+      else:
+        mtime = values[1]
+      nodes = values[header_size:]
+      if output >= len(paths) or any(x >= len(paths) for x in nodes):
+        break
+      deps[output] = nodes
+      mtimes[output] = mtime
+    else:
+      if size < 4:
+        break
+      name = bytes(data[offset:offset + size - 4]).rstrip(b'\0')
+      checksum = _uint32.unpack_from(data, offset + size - 4)[0]
+      if checksum != (~len(paths) & 0xffffffff):
+        break
+      name = name.decode('utf8', 'surrogateescape')
+      if parent is not None:
+        name = path.norm(name, parent)
+      paths.append(name)
+    offset += size
+
+  return DepsLog(paths, deps, mtimes)
+
+
+def read(filename):
+  """
+  Reads the ``.ninja_deps`` file at *filename* and returns a
+  :class:`DepsLog`. Filenames are normalized relative to the directory that
+  contains the file, which is the directory Ninja runs in.
+
+  :raise OSError: If the file can not be read.
+  :raise ValueError: If the format of the file is not supported.
+  """
+
+  parent = path.dirname(path.abs(filename))
+  with open(filename, 'rb') as fp:
+    if not os.fstat(fp.fileno()).st_size:
+      raise ValueError('not a ninja deps log')
+    data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      return parse(data, parent)
+    finally:
+      data.close()
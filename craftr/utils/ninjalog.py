@@ -0,0 +1,183 @@
+# The Craftr build system
+# Copyright (C) 2016  Niklas Rosenstein
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+:mod:`craftr.utils.ninjalog`
+============================
+
+Parser for the ``.ninja_log`` file that Ninja writes into the build
+directory. Every line in the log describes one build edge that was run
+with its start and end time (in milliseconds, relative to the start of
+the Ninja invocation) and the output file it produced.
+"""
+
+from craftr.utils import path
+
+import collections
+import re
+
+
+class LogEntry(collections.namedtuple('LogEntry', 'start end mtime output cmdhash')):
+  """
+  Represents a single line in a ``.ninja_log`` file. The *start* and *end*
+  times are in milliseconds.
+  """
+
+  __slots__ = ()
+
+  @property
+  def duration(self):
+    """
+    The duration of the build edge in seconds.
+    """
+
+    return (self.end - self.start) / 1000.0
+
+
+def parse(fp, parent=None):
+  """
+  Parses a ``.ninja_log`` file from the file-like object *fp* and returns
+  a list of :class:`LogEntry` objects in the order they appear in the file.
+  Relative output filenames are normalized with *parent* if it is specified.
+
+  :raise ValueError: If the log format is not supported.
+  """
+
+  result = []
+  for index, line in enumerate(fp):
+    if index == 0 and line.startswith('#'):
+      match = re.match(r'#\s*ninja log v(\d+)', line)
+      if not match or int(match.group(1)) < 4:
+        raise ValueError('unsupported ninja log format: {!r}'.format(line.strip()))
+      continue
+    parts = line.rstrip('\n').split('\t')
+    if len(parts) != 5:
+      continue
+    start, end, mtime, output, cmdhash = parts
+    if parent is not None:
+      output = path.norm(output, parent)
+    result.append(LogEntry(int(start), int(end), int(mtime), output, cmdhash))
+  return result
+
+
+def read(filename, offset=0):
+  """
+  Reads the ``.ninja_log`` file at *filename* and returns a list of
+  :class:`LogEntry` objects. Output filenames are normalized relative to the
+  directory that contains the log. If *offset* is specified, parsing starts
+  at that byte position in the file (which should be the size of the file
+  when it was last read).
+
+  :raise OSError: If the file can not be read.
+  :raise ValueError: If the log format is not supported.
+  """
+
+  parent = path.dirname(path.abs(filename))
+  with open(filename) as fp:
+    if offset:
+      # Check the header before we seek into the file.
+      parse([fp.readline()])
+      fp.seek(offset)
+    return parse(fp, parent)
+
+
+def latest(entries):
+  """
+  Returns a dictionary that maps each output filename to the most recent
+  :class:`LogEntry` in *entries*.
+  """
+
+  return {entry.output: entry for entry in entries}
+
+
+def last_run(entries):
+  """
+  Returns the entries from *entries* that belong to the last Ninja
+  invocation. Ninja appends entries in the order that the edges finish,
+  so a new run is detected when the end time decreases.
+  """
+
+  index = 0
+  last_end = None
+  for i, entry in enumerate(entries):
+    if last_end is not None and entry.end < last_end:
+      index = i
+    last_end = entry.end
+  return entries[index:]
+
+
+def get_parallelism(entries, buckets=20):
+  """
+  Computes how many build edges ran in parallel over the time of the build
+  described by *entries* (usually the result of :func:`last_run`). The time
+  between the start of the first and the end of the last edge is divided
+  into *buckets* slices. Returns a list of ``(start, end, parallelism)``
+  tuples where *start* and *end* are in seconds and *parallelism* is the
+  average number of edges that were running in that slice.
+  """
+
+  if not entries:
+    return []
+  begin = min(e.start for e in entries)
+  total = max(e.end for e in entries) - begin
+  if total <= 0:
+    return []
+  width = total / float(buckets)
+  busy = [0.0] * buckets
+  for entry in entries:
+    start, end = entry.start - begin, entry.end - begin
+    first = min(int(start / width), buckets - 1)
+    last = min(int(end / width), buckets - 1)
+    for index in range(first, last + 1):
+      overlap = min(end, (index + 1) * width) - max(start, index * width)
+      if overlap > 0:
+        busy[index] += overlap
+  return [((begin + i * width) / 1000.0, (begin + (i + 1) * width) / 1000.0,
+      busy[i] / width) for i in range(buckets)]
+
+
+def to_chrome_trace(entries, names=None):
+  """
+  Converts *entries* to the Chrome trace event format which can be viewed
+  with ``chrome://tracing``. Every edge is assigned to the first free lane
+  so that the lanes reflect the parallel jobs that Ninja was running.
+
+  :param entries: A list of :class:`LogEntry` objects.
+  :param names: A function that is called with a :class:`LogEntry` and
+    returns a tuple of ``(name, category)``. Defaults to the output filename
+    and the category ``"targets"``.
+  :return: A JSON serialisable dictionary.
+  """
+
+  if names is None:
+    names = lambda entry: (entry.output, 'targets')
+
+  events = []
+  lanes = []
+  for entry in sorted(entries, key=lambda x: (x.start, x.end)):
+    for tid, lane_end in enumerate(lanes):
+      if lane_end <= entry.start:
+        lanes[tid] = entry.end
+        break
+    else:
+      tid = len(lanes)
+      lanes.append(entry.end)
+    name, category = names(entry)
+    events.append({
+      'name': name, 'cat': category, 'ph': 'X', 'pid': 0, 'tid': tid,
+      'ts': entry.start * 1000, 'dur': (entry.end - entry.start) * 1000,
+      'args': {'output': entry.output}
+    })
+  return {'traceEvents': events, 'displayTimeUnit': 'ms'}
@@ -22,8 +22,9 @@ from os.path import getmtime
 
 import ctypes
 import errno
-import glob2
+import fnmatch
 import os
+import re
 import shutil
 import tempfile as _tempfile
 
@@ -70,10 +71,13 @@ def canonical(path):
     path = path.lower()
   return path
 
-def glob(patterns, parent=None, excludes=(), include_dotfiles=False, ignore_false_excludes=False):
+def glob(patterns, parent=None, excludes=(), include_dotfiles=False,
+         ignore_false_excludes=False, visited=None):
   """
-  Wrapper for :func:`glob2.glob` that accepts an arbitrary number of
-  patterns and matches them. The paths are normalized with :func:`norm`.
+  Matches the glob *patterns* and returns a list of the matching files and
+  directories. The paths are normalized with :func:`norm`. Patterns support
+  the ``*``, ``?`` and ``[...]`` wildcards of :mod:`fnmatch` and ``**``
+  to match any number of directories.
 
   Relative patterns are automaticlly joined with *parent*. If the
   parameter is omitted, it defaults to the currently executed build
@@ -83,21 +87,30 @@ def glob(patterns, parent=None, excludes=(), include_dotfiles=False, ignore_fals
   that is/contains glob patterns or filenames to be removed from the
   result before returning.
 
+  All patterns are matched in a single traversal of the file system.
+  Directories that are excluded with a pattern ending in ``**`` are not
+  entered. The result is ordered by the first pattern that matched a file,
+  then by the filename.
+
   .. note::
 
-    Every file listed in *excludes* will only remove **one** item from
-    the result list that was generated from *patterns*. Thus, if you
-    want to exclude some files with a pattern except for a specific file
-    that would also match that pattern, simply list that file another
-    time in the *patterns*.
+    A filename that is listed in the *patterns* is returned even if it
+    matches a glob pattern in the *excludes*. Thus, if you want to exclude
+    some files with a pattern except for a specific file that would also
+    match that pattern, simply list that file in the *patterns*.
 
   :param patterns: A list of glob patterns or filenames.
   :param parent: The parent directory for relative paths.
   :param excludes: A list of glob patterns or filenames.
   :param include_dotfiles: If True, ``*`` and ``**`` can also capture
     file or directory names starting with a dot.
-  :param ignore_false_excludes: False by default. If True, items listed
-    in *excludes* that have not been globbed will raise an exception.
+  :param ignore_false_excludes: False by default. If False, filenames
+    listed in *excludes* that have not been matched by the *patterns*
+    will raise an exception.
+  :param visited: A list to which the directories that have been read are
+    appended, as well as the parent directories of the filenames in the
+    *patterns* and *excludes*. The result can only change if one of these
+    directories changes.
   :return: A list of filenames.
   """
 
@@ -111,31 +124,221 @@ def glob(patterns, parent=None, excludes=(), include_dotfiles=False, ignore_fals
   if not parent:
     parent = getcwd()
 
-  result = []
-  for pattern in patterns:
-    if not isabs(pattern):
-      pattern = join(parent, pattern)
-    result += glob2.glob(norm(pattern))
-
-  for pattern in excludes:
-    if not isabs(pattern):
-      pattern = join(parent, pattern)
-    pattern = norm(pattern)
-    if not isglob(pattern):
-      try:
-        result.remove(pattern)
-      except ValueError as exc:
-        if not ignore_false_excludes:
-          raise ValueError('{} ({})'.format(exc, pattern))
-    else:
-      for item in glob2.glob(pattern):
-        try:
-          result.remove(item)
-        except ValueError as exc:
-          if not ignore_false_excludes:
-            raise ValueError('{} ({})'.format(exc, pattern))
+  # Maps paths to the index of the first include pattern that matched.
+  matches = {}
+  excluded = set()
+  literal_includes = set()
+  literal_excludes = []
+  globs = []
+  for exclude, items in ((False, patterns), (True, excludes)):
+    for index, pattern in enumerate(items):
+      pattern = norm(pattern, parent)
+      if isglob(pattern):
+        globs.append(_GlobPattern(pattern, index, exclude, include_dotfiles or exclude))
+        continue
+      if visited is not None:
+        visited.append(dirname(pattern))
+      if exclude:
+        literal_excludes.append(pattern)
+        excluded.add(pattern)
+      elif exists(pattern):
+        literal_includes.add(pattern)
+        if pattern not in matches:
+          matches[pattern] = index
+
+  for base, group in _group_glob_patterns(globs):
+    _glob_walk(base, group, matches, excluded, visited)
+
+  for pattern in literal_excludes:
+    if pattern not in matches and not ignore_false_excludes:
+      raise ValueError('excluded file was not matched ({})'.format(pattern))
+
+  # Filenames in the patterns are only removed by filenames in the excludes.
+  excluded -= literal_includes - set(literal_excludes)
+  result = [(v, k) for k, v in matches.items() if k not in excluded]
+  result.sort()
+  return [x[1] for x in result]
+
+
+class _GlobPattern(object):
+  """
+  A glob pattern that is split into a literal *base* directory and a list
+  of *segments* relative to it. A segment is either the string ``'**'``,
+  a literal name or a compiled regular expression.
+  """
+
+  RECURSIVE = '**'
+
+  def __init__(self, pattern, index, exclude, include_dotfiles):
+    parts = []
+    root = pattern
+    while True:
+      root, tail = split(root)
+      if not tail:
+        break
+      parts.append(tail)
+    parts.reverse()
+    offset = 0
+    while offset < len(parts) and not isglob(parts[offset]):
+      offset += 1
+    self.base = join(root, *parts[:offset])
+    self.segments = [self.compile_segment(x) for x in parts[offset:]]
+    self.dotted = [x.startswith('.') for x in parts[offset:]]
+    self.index = index
+    self.exclude = exclude
+    self.include_dotfiles = include_dotfiles
+
+  @classmethod
+  def compile_segment(cls, segment):
+    if segment == cls.RECURSIVE:
+      return cls.RECURSIVE
+    if not isglob(segment) and '[' not in segment:
+      return os.path.normcase(segment)
+    return re.compile(fnmatch.translate(os.path.normcase(segment)))
+
+  def match(self, pos, name):
+    """
+    Returns True if the segment at *pos* matches the *name*. Wildcards
+    only match names that start with a dot if *include_dotfiles* is True
+    or if the segment starts with a dot as well.
+    """
+
+    segment = self.segments[pos]
+    if isinstance(segment, str):
+      return segment == name
+    if name.startswith('.') and not self.include_dotfiles and not self.dotted[pos]:
+      return False
+    return segment.match(name) is not None
+
+  def rebase(self, base):
+    """
+    Changes the :attr:`base` of the pattern to a parent directory.
+    """
+
+    relpath = os.path.relpath(self.base, base)
+    if relpath != curdir:
+      parts = relpath.split(sep)
+      self.segments = [os.path.normcase(x) for x in parts] + self.segments
+      self.dotted = [x.startswith('.') for x in parts] + self.dotted
+    self.base = base
+
+
+def _group_glob_patterns(patterns):
+  """
+  Groups the :class:`_GlobPattern` objects in *patterns* by their base
+  directory. Patterns whose base directory is inside the base directory of
+  another pattern are rebased, so that every directory is visited only once.
+  Returns a list of ``(base, patterns)`` tuples.
+  """
+
+  groups = []
+  for pattern in sorted(patterns, key=lambda x: x.base):
+    if groups:
+      base = groups[-1][0]
+      prefix = base if base.endswith(sep) else base + sep
+      if pattern.base == base or pattern.base.startswith(prefix):
+        pattern.rebase(base)
+        groups[-1][1].append(pattern)
+        continue
+    groups.append((pattern.base, [pattern]))
+  return groups
+
+
+def _glob_closure(patterns, states):
+  """
+  Adds the states that are reachable by letting ``**`` match no directory
+  to the set of ``(pattern, segment index)`` *states*.
+  """
+
+  stack = list(states)
+  while stack:
+    index, pos = stack.pop()
+    segments = patterns[index].segments
+    if pos < len(segments) and segments[pos] is _GlobPattern.RECURSIVE:
+      if (index, pos + 1) not in states:
+        states.add((index, pos + 1))
+        stack.append((index, pos + 1))
+  return states
+
+
+def _glob_walk(base, patterns, matches, excluded, visited=None):
+  """
+  Walks the directory *base* once and matches all *patterns* against its
+  contents. Files that match an include pattern are added to the *matches*
+  dictionary with the index of the first matching pattern, files that
+  match an exclude pattern are added to the *excluded* set. The directories
+  that have been read are appended to *visited*.
+  """
+
+  initial = _glob_closure(patterns, {(i, 0) for i in range(len(patterns))})
+  stack = [(base, initial)]
+  while stack:
+    dirname, states = stack.pop()
+    if visited is not None:
+      visited.append(dirname)
+    try:
+      if hasattr(os, 'scandir'):
+        entries = [(x.name, x.is_dir(), x.is_symlink()) for x in os.scandir(dirname)]
+      else:
+        entries = [(x, os.path.isdir(join(dirname, x)), os.path.islink(join(dirname, x)))
+            for x in os.listdir(dirname)]
+    except OSError:
+      continue
+
+    for entry_name, is_dir, is_symlink in entries:
+      name = os.path.normcase(entry_name)
+      direct = set()      # states reached by matching a named segment
+      recursive = set()   # states reached by letting ** match the entry
+      for index, pos in states:
+        pattern = patterns[index]
+        if pos == len(pattern.segments):
+          continue
+        segment = pattern.segments[pos]
+        if segment is _GlobPattern.RECURSIVE:
+          if pattern.include_dotfiles or not name.startswith('.'):
+            recursive.add((index, pos))
+        elif pattern.match(pos, name):
+          direct.add((index, pos + 1))
+      if not direct and not recursive:
+        continue
+      next_states = _glob_closure(patterns, direct | recursive)
+
+      first = None
+      is_excluded = False
+      for index, pos in next_states:
+        pattern = patterns[index]
+        if pos == len(pattern.segments):
+          if pattern.exclude:
+            is_excluded = True
+          elif first is None or pattern.index < first:
+            first = pattern.index
+      filename = join(dirname, entry_name)
+      if is_excluded:
+        excluded.add(filename)
+      if first is not None and first < matches.get(filename, first + 1):
+        matches[filename] = first
+
+      if not is_dir:
+        continue
+      # Don't follow symlinks with **, they could point to a parent.
+      if is_symlink:
+        next_states = _glob_closure(patterns, direct)
+      active = covered = False
+      for index, pos in next_states:
+        pattern = patterns[index]
+        rest = pattern.segments[pos:]
+        if pattern.exclude:
+          # An exclude pattern with only ** left excludes everything below.
+          if rest and pattern.include_dotfiles and \
+              all(x is _GlobPattern.RECURSIVE for x in rest):
+            covered = True
+        elif rest:
+          active = True
+      # Skip the directory if nothing can be included from it.
+      if active and not covered:
+        stack.append((filename, {s for s in next_states
+            if s[1] < len(patterns[s[0]].segments)}))
 
-  return result
 
 def isglob(path):
   """
@@ -266,6 +469,32 @@ def remove(path, recursive=False, silent=False):
     if not silent or exc.errno != errno.ENOENT:
       raise
 
+def write_if_changed(filename, content, encoding='utf8'):
+  """
+  Writes *content* to *filename* unless the file already has exactly this
+  content, in which case its modification time is left untouched. Targets
+  that produce their outputs with this function can be created with
+  ``restat=True`` so that Ninja skips everything that depends on outputs
+  that did not change. The parent directory is created if necessary.
+
+  :param filename: The name of the file to write.
+  :param content: A :class:`str` or :class:`bytes` object.
+  :param encoding: The encoding that is used if *content* is a string.
+  :return: True if the file was written, False if it was up to date.
+  """
+
+  if isinstance(content, str):
+    content = content.encode(encoding)
+  try:
+    with open(filename, 'rb') as fp:
+      if fp.read(len(content) + 1) == content:
+        return False
+  except FileNotFoundError:
+    makedirs(dirname(abs(filename)))
+  with open(filename, 'wb') as fp:
+    fp.write(content)
+  return True
+
 def get_long_path_name(path):
   """
   This function is important when using Craftr on platforms with
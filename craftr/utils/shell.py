@@ -14,15 +14,26 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
 import os
 import re
 import shlex
 import subprocess
 import sys
+import threading
 
 from . import path
 from subprocess import PIPE, STDOUT
 
+_prefetch_executor = None
+_prefetch_futures = {}
+_prefetch_pending = set()
+_prefetch_lock = threading.Lock()
+
+# Maps directory names to a tuple of (mtime, names). See _get_dir_index().
+_dir_index = {}
+_dir_index_lock = threading.Lock()
+
 class safe(str):
   """
   If this object is passed to `quote()`, it will not be escaped.
@@ -89,12 +100,44 @@ def join(cmd, for_ninja=False):
   return ' '.join(quote(x, for_ninja=for_ninja) for x in cmd)
 
 
+def _get_dir_index(dirname):
+  """
+  Returns a set of the (case-normalized) names of all entries in the
+  directory *dirname*. The set is cached and re-read only when the
+  modification time of the directory changes. Returns an empty set if the
+  directory does not exist.
+  """
+
+  try:
+    mtime = os.stat(dirname).st_mtime_ns
+  except OSError:
+    return frozenset()
+  with _dir_index_lock:
+    entry = _dir_index.get(dirname)
+  if entry is not None and entry[0] == mtime:
+    return entry[1]
+  try:
+    if hasattr(os, 'scandir'):
+      names = frozenset(os.path.normcase(x.name) for x in os.scandir(dirname))
+    else:
+      names = frozenset(map(os.path.normcase, os.listdir(dirname)))
+  except OSError:
+    names = frozenset()
+  with _dir_index_lock:
+    _dir_index[dirname] = (mtime, names)
+  return names
+
+
 def find_program(name):
   """
   Finds the program *name* in the directories listed by the ``PATH``
   environment variable and returns the full absolute path to it. On Windows,
   this also takes the `PATHEXT` variable into account.
 
+  The contents of the ``PATH`` directories are cached and re-read only if
+  the modification time of a directory changes, thus a lookup costs only
+  one :func:`os.stat` per directory that is searched.
+
   :param name: The name of the program to find.
   :return: :class:`str` -- The absolute path to the program.
   :raise FileNotFoundError: If the program could not be found in the PATH.
@@ -127,9 +170,12 @@ def find_program(name):
 
   first_candidate = None
   for dirname in os.environ['PATH'].split(path.pathsep):
-    fullname = path.join(dirname, name)
+    names = _get_dir_index(dirname)
     for ext in pathext:
-      extname = (fullname + ext) if ext else fullname
+      extname = (name + ext) if ext else name
+      if os.path.normcase(extname) not in names:
+        continue
+      extname = path.join(dirname, extname)
       if path.isfile(extname):
         if os.access(extname, os.X_OK):
           return extname
@@ -141,6 +187,22 @@ def find_program(name):
   raise FileNotFoundError(name)
 
 
+def find_programs(names):
+  """
+  Uses :func:`find_program` to find all programs in *names* and returns a
+  dictionary that maps the names to the absolute paths of the programs that
+  could be found. Every name is looked up only once.
+  """
+
+  result = {}
+  for name in set(names):
+    try:
+      result[name] = find_program(name)
+    except OSError:
+      pass
+  return result
+
+
 def test_program(name):
   """
   Uses :func:`find_program` to find the path to *name* and returns
@@ -312,6 +374,72 @@ def run(cmd, *, stdin=None, input=None, stdout=None, stderr=None, shell=False,
   return process
 
 
+def prefetch(func, *args, **kwargs):
+  """
+  Starts calling *func* with the specified arguments in a background thread
+  and returns a :class:`concurrent.futures.Future` for the result. This is
+  used to run slow probes (usually programs that are executed to detect
+  their version) concurrently as soon as it is known that they will be
+  needed. Calling :meth:`~concurrent.futures.Future.result` on the returned
+  future blocks until the probe finished and re-raises its exception.
+
+  Calls with the same *func* and arguments return the same future, thus the
+  arguments must be hashable. Use this function instead of calling *func*
+  directly to retrieve the result of a probe that may have been prefetched.
+
+  .. note::
+
+    *func* must not depend on the current working directory, the current
+    module or modify global state such as :data:`os.environ`.
+  """
+
+  key = (func, args, tuple(sorted(kwargs.items())))
+  with _prefetch_lock:
+    future = _prefetch_futures.get(key)
+    if future is None:
+      future = _submit(func, args, kwargs)
+      _prefetch_futures[key] = future
+  return future
+
+
+def submit(func, *args, **kwargs):
+  """
+  Like :func:`prefetch`, but always starts a new call and does not remember
+  the returned future. Use this for commands whose output can change while
+  Craftr is running.
+  """
+
+  with _prefetch_lock:
+    return _submit(func, args, kwargs)
+
+
+def _submit(func, args, kwargs):
+  global _prefetch_executor
+  if _prefetch_executor is None:
+    _prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(8, (os.cpu_count() or 1) + 2))
+  future = _prefetch_executor.submit(func, *args, **kwargs)
+  _prefetch_pending.add(future)
+  future.add_done_callback(_prefetch_pending.discard)
+  return future
+
+
+def wait_prefetched():
+  """
+  Blocks until all calls started with :func:`prefetch` or :func:`submit`
+  finished. Probes may store their results in the
+  :attr:`Session.cache<craftr.core.session.Session.cache>`, thus this
+  function must be called before the cache is serialised.
+  """
+
+  while True:
+    with _prefetch_lock:
+      futures = list(_prefetch_pending)
+    if not futures:
+      break
+    concurrent.futures.wait(futures)
+
+
 def pipe(*args, merge=True, **kwargs):
   """
   Like `run()`, but pipes stdout and stderr to a buffer instead of
@@ -0,0 +1,73 @@
+
+from craftr.core import build
+
+import io
+import ninja_syntax
+
+
+class Framework(dict):
+
+  def __init__(self, name, **kwargs):
+    super().__init__(**kwargs)
+    self.name = name
+
+
+QT5 = Framework('qt5',
+  include=['/usr/include/qt5', '/usr/include/qt5/QtCore', '/usr/include/qt5/QtGui'],
+  defines=['QT_CORE_LIB', 'QT_GUI_LIB'])
+APP = Framework('app', frameworks=[QT5])
+
+
+def compile_command(project_include, source):
+  command = ['gcc', '-c', '-I' + project_include]
+  command += ['-I' + x for x in QT5['include']]
+  command += ['-D' + x for x in QT5['defines']]
+  return command + [source]
+
+
+def test_framework_variables():
+  commands = [compile_command('/p/src/a', 'a.c'), compile_command('/p/src/b', 'b.c')]
+  flag_vars = build.get_flag_variables(commands, frameworks=[[APP], [QT5]])
+  assert sorted(flag_vars.values()) == ['fw_qt5_include']
+  assert build.replace_flag_variables(commands[0], flag_vars) == ['gcc', '-c',
+    '-I/p/src/a', '$fw_qt5_include', '-DQT_CORE_LIB', '-DQT_GUI_LIB', 'a.c']
+
+  # Without frameworks, only identical runs of flags are hoisted.
+  assert build.get_flag_variables(commands) == {}
+  flag_vars = build.get_flag_variables(commands, min_size=20)
+  assert list(flag_vars.values()) == []
+  flag_vars = build.get_flag_variables(commands, min_size=20, frameworks=[[QT5], [QT5]])
+  assert sorted(flag_vars.values()) == ['fw_qt5_defines', 'fw_qt5_include']
+
+
+def test_flag_runs():
+  commands = [['cc', '-Wall', '-Wextra', '-pedantic', '-std=c11', 'a.c'],
+    ['cc', '-Wall', '-Wextra', '-pedantic', '-std=c11', 'b.c'],
+    ['cc', '-Wall', 'c.c']]
+  flag_vars = build.get_flag_variables(commands, min_size=20)
+  assert list(flag_vars.values()) == ['flags_0']
+  assert build.replace_flag_variables(commands[1], flag_vars) == ['cc', '$flags_0', 'b.c']
+  assert build.replace_flag_variables(commands[2], flag_vars) == commands[2]
+
+
+def test_export_framework_variables():
+  graph = build.Graph()
+  for name in ('a', 'b'):
+    graph.add_target(build.Target('main.' + name,
+      [compile_command('/p/src/' + name, '/p/src/{}.c'.format(name))],
+      ['/p/src/{}.c'.format(name)], ['/p/build/{}.o'.format(name)],
+      frameworks=[APP]))
+  context = build.ExportContext('1.7.2', builddir='/p/build', rootdir='/p')
+
+  class Platform(object):
+    def prepare_commands(self, commands):
+      return commands
+    def prepare_single_command(self, command, cwd):
+      return command
+
+  fp = io.StringIO()
+  graph.export(ninja_syntax.Writer(fp), context, Platform())
+  manifest = fp.getvalue()
+  assert 'fw_qt5_include = -I/usr/include/qt5 ' in manifest
+  assert manifest.count('-I/usr/include/qt5/QtGui') == 1
+  assert 'gcc -c -I../src/a $fw_qt5_include' in manifest
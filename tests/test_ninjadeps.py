@@ -0,0 +1,97 @@
+
+from craftr.utils import ninjadeps
+
+import os
+import struct
+import tempfile
+
+
+def path_record(name, node):
+  data = name.encode('utf8')
+  data += b'\0' * (-len(data) % 4)
+  data += struct.pack('<I', ~node & 0xffffffff)
+  return struct.pack('<I', len(data)) + data
+
+
+def deps_record(version, output, mtime, nodes):
+  if version >= 4:
+    values = [output, mtime & 0xffffffff, mtime >> 32] + list(nodes)
+  else:
+    values = [output, mtime] + list(nodes)
+  data = struct.pack('<{}I'.format(len(values)), *values)
+  return struct.pack('<I', len(data) | 0x80000000) + data
+
+
+def make_log(version, mtime=1234):
+  data = ninjadeps.SIGNATURE + struct.pack('<I', version)
+  for index, name in enumerate(['a.o', 'a.c', 'common.h', 'b.o', 'b.c']):
+    data += path_record(name, index)
+  data += deps_record(version, 0, mtime, [1, 2])
+  data += deps_record(version, 3, mtime, [4])
+  # A later record for the same output replaces the earlier one.
+  data += deps_record(version, 3, mtime + 1, [4, 2])
+  return data
+
+
+def test_parse_versions():
+  for version, mtime in ((3, 1234), (4, (5 << 32) | 1234)):
+    log = ninjadeps.parse(make_log(version, mtime))
+    assert len(log) == 2
+    assert log.paths == ['a.o', 'a.c', 'common.h', 'b.o', 'b.c']
+    assert log.get_dependencies('a.o') == ['a.c', 'common.h']
+    assert log.get_dependencies('b.o') == ['b.c', 'common.h']
+    assert log.get_dependencies('a.c') is None
+    assert log.mtimes == {0: mtime, 3: mtime + 1}
+    assert dict(log.items()) == {'a.o': ['a.c', 'common.h'], 'b.o': ['b.c', 'common.h']}
+
+
+def test_parse_invalid():
+  for data in (b'', b'# ninja log v5\n', ninjadeps.SIGNATURE + struct.pack('<I', 2)):
+    try:
+      ninjadeps.parse(data)
+    except ValueError:
+      pass
+    else:
+      assert False, 'expected ValueError'
+
+
+def test_parse_truncated():
+  data = make_log(4)
+  full = ninjadeps.parse(data)
+  # Parsing stops at the last complete record.
+  log = ninjadeps.parse(data[:-3])
+  assert log.get_dependencies('b.o') == ['b.c']
+  assert log.mtimes[3] == full.mtimes[3] - 1
+  # A path record with an invalid checksum ends the log.
+  data = ninjadeps.SIGNATURE + struct.pack('<I', 4)
+  data += path_record('a.o', 0) + path_record('a.c', 5) + deps_record(4, 0, 0, [0])
+  log = ninjadeps.parse(data)
+  assert log.paths == ['a.o']
+  assert len(log) == 0
+  # So does a dependency record that refers to an unknown node.
+  data = ninjadeps.SIGNATURE + struct.pack('<I', 4)
+  data += path_record('a.o', 0) + deps_record(4, 0, 0, [1]) + path_record('a.c', 1)
+  log = ninjadeps.parse(data)
+  assert log.paths == ['a.o']
+
+
+def test_dependents_and_fan_in():
+  log = ninjadeps.parse(make_log(4))
+  assert log.get_dependents('common.h') == ['a.o', 'b.o']
+  assert log.get_dependents('a.c') == ['a.o']
+  assert log.get_dependents('missing.h') == []
+  assert log.get_fan_in(1) == [('common.h', 2)]
+  assert sorted(log.get_fan_in()) == [('a.c', 1), ('b.c', 1), ('common.h', 2)]
+
+
+def test_read():
+  fd, filename = tempfile.mkstemp()
+  try:
+    with os.fdopen(fd, 'wb') as fp:
+      fp.write(make_log(4))
+    log = ninjadeps.read(filename)
+    parent = os.path.dirname(os.path.abspath(filename))
+    assert log.get_dependencies(os.path.join(parent, 'a.o')) == \
+      [os.path.join(parent, 'a.c'), os.path.join(parent, 'common.h')]
+  finally:
+    os.remove(filename)
@@ -0,0 +1,68 @@
+
+from craftr.utils import ninjalog
+
+import io
+import os
+import tempfile
+
+HEADER = '# ninja log v5\n'
+FIRST_RUN = '0\t100\t1\ta.o\t1a\n50\t200\t1\tb.o\t2b\n200\t300\t1\tapp\t3c\n'
+SECOND_RUN = '0\t80\t2\ta.o\t1a\n80\t150\t2\tapp\t4d\n'
+
+
+def test_parse():
+  entries = ninjalog.parse(io.StringIO(HEADER + FIRST_RUN + 'invalid line\n'))
+  assert [e.output for e in entries] == ['a.o', 'b.o', 'app']
+  assert entries[1] == ninjalog.LogEntry(50, 200, 1, 'b.o', '2b')
+  assert entries[1].duration == 0.15
+  assert ninjalog.parse(io.StringIO(HEADER + '0\t1\ta.o\t1a\n')) == []
+  entries = ninjalog.parse(io.StringIO(HEADER + '0\t1\t1\tsub/a.o\t1a\n'), '/build')
+  assert entries[0].output == os.path.normpath('/build/sub/a.o')
+
+
+def test_parse_unsupported():
+  for header in ('# ninja log v3\n', '# not a ninja log\n'):
+    try:
+      ninjalog.parse(io.StringIO(header + FIRST_RUN))
+    except ValueError:
+      pass
+    else:
+      assert False, 'expected ValueError'
+
+
+def test_last_run_and_latest():
+  entries = ninjalog.parse(io.StringIO(HEADER + FIRST_RUN + SECOND_RUN))
+  last = ninjalog.last_run(entries)
+  assert [(e.output, e.end) for e in last] == [('a.o', 80), ('app', 150)]
+  assert ninjalog.last_run([]) == []
+  latest = ninjalog.latest(entries)
+  assert latest['a.o'].end == 80
+  assert latest['b.o'].end == 200
+  assert latest['app'].cmdhash == '4d'
+
+
+def test_read_offset():
+  fd, filename = tempfile.mkstemp()
+  try:
+    with os.fdopen(fd, 'w') as fp:
+      fp.write(HEADER + FIRST_RUN)
+      offset = fp.tell()
+      fp.write(SECOND_RUN)
+    parent = os.path.dirname(os.path.abspath(filename))
+    entries = ninjalog.read(filename)
+    assert len(entries) == 5
+    assert entries[0].output == os.path.join(parent, 'a.o')
+    entries = ninjalog.read(filename, offset)
+    assert [(e.output, e.end) for e in entries] == \
+      [(os.path.join(parent, 'a.o'), 80), (os.path.join(parent, 'app'), 150)]
+    # The header is checked even if parsing starts at an offset.
+    with open(filename, 'w') as fp:
+      fp.write('# ninja log v3\n' + FIRST_RUN)
+    try:
+      ninjalog.read(filename, offset)
+    except ValueError:
+      pass
+    else:
+      assert False, 'expected ValueError'
+  finally:
+    os.remove(filename)
@@ -0,0 +1,97 @@
+
+from craftr.utils import path
+
+import os
+import shutil
+import tempfile
+
+basedir = None
+
+FILES = [
+  'main.cpp',
+  'main.h',
+  '.hidden.cpp',
+  'src/a.cpp',
+  'src/b.cpp',
+  'src/b.h',
+  'src/.dot/c.cpp',
+  'src/sub/d.cpp',
+  'third_party/lib/e.cpp',
+  'third_party/lib/e.h',
+]
+
+
+def setup_module():
+  global basedir
+  basedir = tempfile.mkdtemp()
+  for name in FILES:
+    filename = os.path.join(basedir, name)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    open(filename, 'w').close()
+
+
+def teardown_module():
+  shutil.rmtree(basedir)
+
+
+def glob(patterns, excludes=(), **kwargs):
+  result = path.glob(patterns, basedir, excludes, **kwargs)
+  return [os.path.relpath(x, basedir).replace(os.sep, '/') for x in result]
+
+
+def test_glob_simple():
+  assert glob('*.cpp') == ['main.cpp']
+  assert glob('src/?.cpp') == ['src/a.cpp', 'src/b.cpp']
+  assert glob(['src/[ab].*']) == ['src/a.cpp', 'src/b.cpp', 'src/b.h']
+
+
+def test_glob_recursive():
+  assert glob('**/*.cpp') == ['main.cpp', 'src/a.cpp', 'src/b.cpp',
+    'src/sub/d.cpp', 'third_party/lib/e.cpp']
+  assert glob('src/**/d.cpp') == ['src/sub/d.cpp']
+  assert glob('src/**') == ['src/a.cpp', 'src/b.cpp', 'src/b.h',
+    'src/sub', 'src/sub/d.cpp']
+
+
+def test_glob_dotfiles():
+  assert glob('.*.cpp') == ['.hidden.cpp']
+  assert glob('src/.dot/*') == ['src/.dot/c.cpp']
+  assert glob('**/*.cpp', include_dotfiles=True) == ['.hidden.cpp',
+    'main.cpp', 'src/.dot/c.cpp', 'src/a.cpp', 'src/b.cpp', 'src/sub/d.cpp',
+    'third_party/lib/e.cpp']
+
+
+def test_glob_ordering():
+  # Files are ordered by the first pattern that matched them.
+  assert glob(['src/*.h', '**/*.cpp', 'src/*']) == ['src/b.h', 'main.cpp',
+    'src/a.cpp', 'src/b.cpp', 'src/sub/d.cpp', 'third_party/lib/e.cpp', 'src/sub']
+  assert glob(['src/b.cpp', 'src/*.cpp']) == ['src/b.cpp', 'src/a.cpp']
+
+
+def test_glob_excludes():
+  assert glob('src/*.cpp', ['src/a.cpp']) == ['src/b.cpp']
+  assert glob('**/*.cpp', ['**/b.cpp', 'src/sub/**']) == ['main.cpp',
+    'src/a.cpp', 'third_party/lib/e.cpp']
+  # Filenames in the patterns are returned even if an exclude pattern
+  # matches them, but not if they are listed in the excludes.
+  assert glob(['src/*.cpp', 'src/a.cpp'], ['src/*']) == ['src/a.cpp']
+  assert glob(['**/*.cpp', 'third_party/lib/e.cpp'], ['third_party/**']) == \
+    ['main.cpp', 'src/a.cpp', 'src/b.cpp', 'src/sub/d.cpp', 'third_party/lib/e.cpp']
+  assert glob(['src/*.cpp', 'src/a.cpp'], ['src/a.cpp']) == ['src/b.cpp']
+  try:
+    glob('src/*.cpp', ['src/sub/d.cpp'])
+  except ValueError:
+    pass
+  else:
+    assert False, 'expected ValueError'
+  assert glob('src/*.cpp', ['src/sub/d.cpp'], ignore_false_excludes=True) == \
+    ['src/a.cpp', 'src/b.cpp']
+
+
+def test_glob_pruning():
+  visited = []
+  result = glob(['**/*.cpp', '**/*.h'], ['third_party/**'], visited=visited)
+  assert result == ['main.cpp', 'src/a.cpp', 'src/b.cpp', 'src/sub/d.cpp',
+    'main.h', 'src/b.h']
+  visited = sorted(os.path.relpath(x, basedir) for x in visited)
+  assert visited == ['.', 'src', os.path.join('src', 'sub')]
@@ -0,0 +1,83 @@
+
+from craftr.core.session import Session, CACHE_MAGIC
+
+import collections
+import io
+import json
+
+CACHE = {
+  'build': {'targets': ['main.app'], 'modules': {'main': {'1.0.0': {}}}},
+  'globs': {'["*.c"]': {'dirs': {'/src': 1}, 'result': ['/src/a.c']}},
+  'tools': {'cxx': {'gcc': {'version': '6.2.0', 'flags': [1.5, None, True]}}},
+}
+
+
+def write(cache):
+  session = Session('/project')
+  session.cache = cache
+  fp = io.BytesIO()
+  session.write_cache(fp)
+  fp.seek(0)
+  return fp
+
+
+def read(fp, sections=None):
+  session = Session('/project')
+  session.read_cache(fp, sections)
+  return session.cache
+
+
+def test_round_trip():
+  fp = write(CACHE)
+  assert fp.getvalue().startswith(CACHE_MAGIC)
+  assert read(fp) == CACHE
+
+
+class Name(str):
+  pass
+
+
+def test_round_trip_subclasses():
+  cache = {
+    'build': collections.OrderedDict([('targets', [Name('main.app')])]),
+    Name('tools'): {'cxx': {Name('gcc'): {'version': '6.2.0'}}},
+  }
+  result = read(write(cache))
+  assert result == {'build': {'targets': ['main.app']},
+    'tools': {'cxx': {'gcc': {'version': '6.2.0'}}}}
+  assert type(result['build']) is dict
+  assert type(result['build']['targets'][0]) is str
+
+
+def test_read_sections():
+  fp = write(CACHE)
+  assert read(fp, ['build']) == {'build': CACHE['build']}
+  fp.seek(0)
+  assert read(fp, ['tools', 'missing']) == {'tools': CACHE['tools']}
+  fp.seek(0)
+  assert read(fp, []) == {}
+
+
+def test_read_legacy_json():
+  fp = io.BytesIO(json.dumps(CACHE).encode('utf8'))
+  assert read(fp) == CACHE
+  fp.seek(0)
+  assert read(fp, ['globs']) == {'globs': CACHE['globs']}
+
+
+def test_read_invalid():
+  for data in (b'[1, 2, 3]', b'{', write(CACHE).getvalue()[:len(CACHE_MAGIC) + 2]):
+    try:
+      read(io.BytesIO(data))
+    except ValueError:
+      pass
+    else:
+      assert False, 'expected ValueError'
+
+
+def test_dump_cache():
+  session = Session('/project')
+  session.cache = CACHE
+  fp = io.StringIO()
+  session.dump_cache(fp)
+  assert json.loads(fp.getvalue()) == CACHE
@@ -0,0 +1,87 @@
+
+from craftr.core import statcache
+
+import os
+import shutil
+import tempfile
+import time
+
+basedir = None
+
+
+def setup_module():
+  global basedir
+  basedir = tempfile.mkdtemp()
+
+
+def teardown_module():
+  shutil.rmtree(basedir)
+
+
+def write(name, content, age=None):
+  filename = os.path.join(basedir, name)
+  with open(filename, 'w') as fp:
+    fp.write(content)
+  if age is not None:
+    mtime = int((time.time() - age) * 10**9)
+    os.utime(filename, ns=(mtime, mtime))
+  return filename
+
+
+def test_get_hashes():
+  cachefile = os.path.join(basedir, 'hashes.craftrstat')
+  filename = write('hashes.txt', 'foo', age=3600)
+  missing = os.path.join(basedir, 'missing.txt')
+  cache = statcache.StatCache(cachefile)
+  hashes = cache.get_hashes([filename, missing, basedir])
+  assert hashes[filename] == statcache.hash_file(filename)
+  assert hashes[missing] is None
+  assert hashes[basedir] == statcache.hash_file(basedir)
+  assert cache.modified
+  cache.save()
+  assert not cache.modified
+
+  # Unchanged files are not hashed again.
+  cache = statcache.StatCache(cachefile)
+  cache.get_hashes([filename])
+  assert not cache.modified
+  digest = cache.get_digest([filename])
+  write('hashes.txt', 'bar!')
+  assert cache.get_digest([filename]) != digest
+
+
+def test_racy_window():
+  cachefile = os.path.join(basedir, 'racy.craftrstat')
+  old = write('old.txt', 'foo', age=3600)
+  new = write('new.txt', 'foo')
+  unused = write('unused.txt', 'foo', age=3600)
+  cache = statcache.StatCache(cachefile)
+  cache.get_hashes([old, new, unused])
+  cache.save()
+
+  # Modify both files without changing their size and modification time.
+  for filename in (old, new):
+    st = os.stat(filename)
+    write(os.path.basename(filename), 'baz')
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+  # The entry of the file that was modified within the racy window has been
+  # invalidated, thus it is hashed again, while the stat information of the
+  # old file is trusted.
+  cache = statcache.StatCache(cachefile)
+  assert cache.entries[new][:3] == [None, None, None]
+  assert cache.entries[old][0] is not None
+  hashes = cache.get_hashes([old, new])
+  assert hashes[new] == statcache.hash_file(new)
+  assert hashes[old] != statcache.hash_file(old)
+
+  # Entries of files that were not requested are removed.
+  cache.save()
+  assert unused not in statcache.StatCache(cachefile).entries
+
+
+def test_invalid_file():
+  cachefile = write('invalid.craftrstat', '[1, 2, 3]')
+  assert statcache.StatCache(cachefile).entries == {}
+  cachefile = write('invalid.craftrstat', '{')
+  assert statcache.StatCache(cachefile).entries == {}